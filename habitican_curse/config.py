@@ -10,6 +10,7 @@ import datetime
 import os
 
 NUM_CONTEXT_REGISTERS = 4
+CONTEXT_STACK_SIZE = 8    # Oldest saved contexts are dropped beyond this
 
 # Screen Specifications - Will be adjusted during runtime
 SCR_MAX_MENU_ROWS   = 10   # Keep this as an even number please
@@ -64,6 +65,9 @@ SYMBOL_LEVEL = u'\u2949'.encode("utf-8")
 SYMBOL_DUE = u'\u29D6'.encode("utf-8")
 SYMBOL_CHALLENGE_FLAG = u'\u2691'.encode("utf-8")
 
+# Colors of the write-behind state of a task (see MenuItem.sync)
+SYNC_COLORS = {'pending': SCR_COLOR_YELLOW, 'sent': SCR_COLOR_GREEN, 'failed': SCR_COLOR_RED}
+
 # Status Attributes
 HabitStatus = {'+': 0, '-': 0, SYMBOL_DELETE: False, SYMBOL_EDIT: False}
 HabitPosStatus = {'+': 0, SYMBOL_DELETE: False, SYMBOL_EDIT: False}
@@ -81,6 +85,10 @@ def ConfigureRuntime(screen):
     SCR_TEXT_AREA_LENGTH = (SCR_X - (SCR_MAX_MENU_ROWS + 7 + 4))
     SCR_FIRST_HALF_LENGTH = SCR_MAX_MENU_ROWS + 7
 
+# How often (in milliseconds) the input loop wakes up to handle the results
+# of background operations while no key is pressed
+INPUT_POLL_INTERVAL = 100
+
 # Parser Settings
 SET_COMMANDS = ["d", "due", "every", "weekly", "direction"]
 DIFFS      = ["trivial", "easy", "medium", "hard"]
@@ -131,3 +139,24 @@ def getConfig(value):
         return user_config[value]
 
     return None
+
+# Directory for files kept between sessions (override with "cache_dir")
+def getDataFile(name):
+    data_dir = getConfig("cache_dir")
+    if( data_dir is None ):
+        data_dir = os.getenv("HOME")+'/.habitican_curse'
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    return os.path.join(data_dir, name)
+
+def getConfigInt(value, default):
+    setting = getConfig(value)
+    if( setting is None ):
+        return default
+
+    try:
+        return int(setting)
+    except ValueError:
+        return default
@@ -5,8 +5,12 @@
 """
 
 # Standard Library Imports
-import time
 import math
+import sys
+import os
+import json
+import time
+import functools
 
 # Custom Module Imports
 
@@ -18,24 +22,159 @@ import menu as M
 import task as T
 import debug as DEBUG
 import user as U
+import workers as W
 
 #Set up logging
 import logging
 logger = logging.getLogger(__name__)
 logger.debug("Debug logging started for %s..." % __name__)
 
-class ContentManager(object):
-    """ Class for managing Habitica content """
+# On-disk copy of the content, revalidated against the server at startup
+CONTENT_CACHE_FILE = "content.json"
+CONTENT_CACHE_VERSION = 2   # Bump when the cached layout changes
+
+# Expected upper bound on the size of the projected content (in bytes).
+# Exceeding it is logged, as it means Habitica grew its content a lot.
+CONTENT_MEMORY_CEILING = 2*1024*1024
+
+# Layout of a projected gear entry
+GEAR_FIELDS = ['klass', 'specialClass', 'str', 'int', 'per', 'con']
+
+# Party chat messages shown at first, and added each time the chat is
+# scrolled past the last one
+CHAT_PAGE_SIZE = 50
+
+# Check for new chat messages every so many seconds while the chat is shown
+# ("chat_poll_interval", 0 to only check when it is opened)
+CHAT_POLL_INTERVAL = 15
+
+# Reopening the party only fetches its chat; the whole party (quest
+# progress etc.) is fetched again once it is older than this (in seconds)
+PARTY_MAX_AGE = 300
+
+def ProjectQuest(quest):
+    projected = {'text': quest['text']}
+    if quest.has_key('boss'):
+        boss = quest['boss']
+        projected['boss'] = {'name': boss['name'], 'hp': boss['hp'],
+                             'str': boss['str'], 'rage': boss.get('rage', None)}
+    if quest.has_key('collect'):
+        projected['collect'] = dict((key, {'text': value['text'], 'count': value['count']})
+                                    for (key, value) in quest['collect'].items())
+    return projected
+
+def ProjectGear(gear):
+    return [intern(str(gear.get('klass', ''))), intern(str(gear.get('specialClass', ''))),
+            gear.get('str', 0), gear.get('int', 0), gear.get('per', 0), gear.get('con', 0)]
+
+def ProjectContent(contentDict):
+    # Keep only what Quest() and Equipment() need out of the (several MB)
+    # /content payload; the rest is released with the raw dict
+    return {'quests': dict((key, ProjectQuest(value))
+                           for (key, value) in contentDict['quests'].items()),
+            'gear': dict((key, ProjectGear(value))
+                         for (key, value) in contentDict['gear']['flat'].items())}
+
+def MemorySize(obj):
+    # Approximate resident size of a JSON-like structure
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(MemorySize(k) + MemorySize(v) for (k, v) in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(MemorySize(i) for i in obj)
+    return size
+
+def ReadContentCache():
+    try:
+        with open(C.getDataFile(CONTENT_CACHE_FILE), 'r') as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        logger.debug("No usable content cache: %s" % str(e))
+        return None
+
+    if cache.get('version') != CONTENT_CACHE_VERSION:
+        return None
+
+    return cache
+
+def WriteContentCache(content, validators):
+    cache = {'version': CONTENT_CACHE_VERSION, 'validators': validators,
+             'content': content}
+    try:
+        fileName = C.getDataFile(CONTENT_CACHE_FILE)
+        with open(fileName+".tmp", 'w') as f:
+            json.dump(cache, f)
+        os.rename(fileName+".tmp", fileName)
+    except (IOError, OSError) as e:
+        logger.warn("Could not write content cache: %s" % str(e))
+
+def LoadContent():
+    # Serve the cached content right away and revalidate it in the
+    # background. Only download it if there is no cache yet.
+    cache = ReadContentCache()
+    if cache is None:
+        contentDict, validators = G.reqManager.FetchGameContentIfChanged()
+        content = ProjectContent(contentDict)
+        WriteContentCache(content, validators)
+        return ContentManager(content, validators)
+
+    manager = ContentManager(cache['content'], cache['validators'])
+    W.Spawn(manager.Revalidate)
+    return manager
 
-    def __init__(self):
-        #DEBUG.Display("Content Fetching in progress...")
-        self.contentDict = G.reqManager.FetchGameContent()
+
+class ContentManager(object):
+    """ Class for managing Habitica content. Only a projection of the
+    content (see ProjectContent) is kept in memory """
+
+    def __init__(self, content=None, validators=None):
+        if validators is None:
+            validators = {}
+
+        if content is None:
+            #DEBUG.Display("Content Fetching in progress...")
+            content = ProjectContent(G.reqManager.FetchGameContent())
+
+        self.SetContent(content)
+        self.validators = validators   # ETag/Last-Modified of this copy
+
+    def SetContent(self, content):
+        self.quests = content['quests']
+        self.gear   = content['gear']
+
+        size = MemorySize(content)
+        logger.debug("Projected content takes %d KB" % (size/1024))
+        if size > CONTENT_MEMORY_CEILING:
+            logger.warn("Projected content (%d KB) exceeds its memory ceiling" % (size/1024))
+
+    def Revalidate(self):
+        contentDict, validators = G.reqManager.FetchGameContentIfChanged(self.validators)
+        if contentDict is None:
+            logger.debug("Cached content is up to date")
+            return
+
+        logger.debug("Content changed on the server, updating the cache")
+        content = ProjectContent(contentDict)
+        del contentDict
+        self.SetContent(content)
+        self.validators = validators
+        WriteContentCache(content, validators)
 
     def Quest(self, key):
-        return self.contentDict['quests'].get(key, {})
+        return self.quests.get(key, {})
 
     def Equipment(self, key):
-        return self.contentDict['gear']['flat'][key]
+        return dict(zip(GEAR_FIELDS, self.gear[key]))
+
+
+def ChatDetails(message):
+    # Sender and age of a chat message, only worked out when it is displayed
+    timeElapsed = H.GetDifferenceTime(message['timestamp'])
+    return (message.get('user', '') + " " + timeElapsed).encode("utf-8")
+
+def ChatItem(message):
+    return M.SimpleTextItem(str(message['text'].encode("utf-8")),
+                            additional=functools.partial(ChatDetails, message))
 
 
 class Party(object):
@@ -54,24 +193,26 @@ class Party(object):
         # V3 changes, members don't work no more :(
         self.members = ['(Member list not implemented)']
 
+        # Chat messages, newest first. Older pages are only turned into
+        # menu items when scrolled to.
         self.chat    = party['chat']
-        chat_items = []
-        chatList = self.chat[:50]
-        for i in chatList:
-            timeElapsed = H.GetDifferenceTime(i['timestamp'])
-            detailString = i.get('user', '') + " " + timeElapsed
-            chat_items += [M.SimpleTextItem(str(i['text'].encode("utf-8")), additional=str(detailString))]
+        self.chatShown = 0
+        self.chatMenu = M.SimpleTextMenu(self.MoreChat(), C.SCR_TEXT_AREA_LENGTH,
+                                         more=self.MoreChat)
 
-        self.chatMenu = M.SimpleTextMenu(chat_items, C.SCR_TEXT_AREA_LENGTH)
+        # New messages are merged in by id (see PollChat)
+        self.chatIDs = set([i.get('id') for i in self.chat])
+        self.chatFuture = None
+        self.fetched = time.time()
+        self.lastPoll = self.fetched
 
         self.quest = party.get('quest', None)
         logger.debug("Current Quest: %s" % str(self.quest))
-        if self.quest != None:
-            while (G.content == None):
-                DEBUG.Display("Fetching Content...")
-                time.sleep(5)
-            DEBUG.Display(" ")
+        if self.quest != None and G.intf.WaitForContent() is None:
+            # Show the chat without the quest
+            self.quest = None
 
+        if self.quest != None:
             self.questDetails = G.content.Quest(str(self.quest['key'].encode("utf-8")))
             self.questText    = str(self.questDetails['text'].encode("utf-8"))
 
@@ -96,6 +237,51 @@ class Party(object):
                     self.progress      = party['quest']['progress']['collect']
 
 
+    def MoreChat(self):
+        # The next page of older chat messages
+        page = self.chat[self.chatShown:self.chatShown+CHAT_PAGE_SIZE]
+        self.chatShown += len(page)
+        return [ChatItem(i) for i in page]
+
+    def Age(self):
+        return time.time() - self.fetched
+
+    def RequestChat(self):
+        # Fetch the chat in the background, merged by PollChat
+        if self.chatFuture is None:
+            self.chatFuture = G.reqManager.FetchPartyChatAsync()
+
+    def MergeChat(self, messages):
+        # Add the messages which are not shown yet (the newest, at the start
+        # of the chat) above the others. Returns the number of new messages.
+        new = [i for i in messages if i.get('id') not in self.chatIDs]
+        if not new:
+            return 0
+
+        self.chatIDs.update([i.get('id') for i in new])
+        self.chat = new + self.chat
+        self.chatShown += len(new)
+        self.chatMenu.Prepend([ChatItem(i) for i in new])
+        return len(new)
+
+    def PollChat(self):
+        # Called while the chat is shown and no key is pressed
+        if self.chatFuture is not None:
+            if not self.chatFuture.Done():
+                return
+
+            future, self.chatFuture = self.chatFuture, None
+            self.lastPoll = time.time()
+            if future.Failed():
+                logger.warn("Could not fetch the chat: %s" % str(future.error))
+            elif self.MergeChat(future.Result()):
+                self.chatMenu.Display()
+            return
+
+        interval = C.getConfigInt("chat_poll_interval", CHAT_POLL_INTERVAL)
+        if interval > 0 and time.time() - self.lastPoll >= interval:
+            self.RequestChat()
+
     def Display(self):
         G.screen.ClearTextArea()
         X, Y = C.SCR_FIRST_HALF_LENGTH-2, 1
@@ -131,7 +317,7 @@ class Party(object):
         self.chatMenu.SetXY(X+1, 1)
         self.chatMenu.SetNumRows(MAX_X - (X + 1))
         self.chatMenu.Display()
-        self.chatMenu.Input()
+        self.chatMenu.Input(idle=self.PollChat)
 
 def CheckDrops(response):
     drop = None
@@ -158,15 +344,17 @@ def EffectiveValueTask(value): # Value used for calculation of damages.
 
 def GetData():
 
-    DEBUG.Display("Please Wait...")
-    data = G.reqManager.FetchUserData()
-    DEBUG.Display(" ")
+    # Both fetches run at once
+    userFuture = G.reqManager.FetchUserDataAsync(['stats', 'items.gear.equipped', 'party'])
+    dailiesFuture = G.reqManager.FetchUserTasksAsync("dailys")
+
+    data = G.intf.Await(userFuture)
+    if data is None:
+        return
 
     # Calculate Damage to User
-    while (G.content == None):
-        DEBUG.Display("Fetching Content...")
-        time.sleep(5)
-    DEBUG.Display(" ")
+    if G.intf.WaitForContent() is None:
+        return
 
     userStats = H.GetUserStats(data)
     stealth = data['stats']['buffs']['stealth']
@@ -183,12 +371,15 @@ def GetData():
         questDetails = G.content.Quest(quest['key'])
         userDamageBoss = math.floor(quest['progress']['up']*10)/10
 
-    dailies = G.reqManager.FetchUserTasks("dailys")
+    dailies = G.intf.Await(dailiesFuture)
+    if dailies is None:
+        return
     dailiesIncomplete = 0
 
     for daily in dailies:
         logger.debug("Processing Daily: %s" % str(daily['text'].encode("utf-8")))
-        if not H.isDueDaily(daily) or daily['completed']:
+        if (not H.isDueDaily(daily['frequency'], daily['repeat'], daily['everyX'], daily['startDate'])
+                or daily['completed']):
             continue
 
         dailiesIncomplete += 1
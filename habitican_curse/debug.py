@@ -21,6 +21,7 @@ else:
 def Display(string):
     G.screen.Display(" "*(C.SCR_Y-1))
     G.screen.Display(string)
+    G.screen.Commit()
     if string is not " ":
         logging.debug("CURSES DISPLAY \"%s\"" % string)
 
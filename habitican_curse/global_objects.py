@@ -9,8 +9,9 @@ user = None     # User object
 reqManager = None
 currentTask = None
 prevTask = None
-content = None  # This will be initialized using a thread,
+content = None  # This will be initialized in the background,
                 # so as to reduce start time
+contentFuture = None    # W.Future of the content (see Interface.LoadContent)
 
 # Task Menus
 HabitMenu = None
@@ -19,4 +20,5 @@ TODOMenu = None
 
 # Global data
 LastUpdate = None
+stale = False   # Data shown is from the snapshot of the last session
 Logger = None
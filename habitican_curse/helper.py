@@ -278,26 +278,28 @@ def GetDifferenceTime(d2, d1=-1): # d1 - d2
     return str(diffDate.minutes)+'m ago'
 
 
-def isDueDaily(task):
-    if task['frequency'] == 'weekly':
+# Takes the scheduling fields of a daily rather than its JSON, so that the
+# task model does not have to build it
+def isDueDaily(frequency, repeat, everyX, startDate):
+    if frequency == 'weekly':
         translateDict = {0: 'm', 1: 't', 2: 'w', 3: 'th', 4: 'f', 5: 's', 6: 'su'}
-        if task['repeat'][translateDict[datetime.today().weekday()]]:
+        if repeat[translateDict[datetime.today().weekday()]]:
             return True
         else:
             return False
 
-    elif task['frequency'] == 'daily':
-        if (task['everyX'] == 0):
+    elif frequency == 'daily':
+        if (everyX == 0):
             return False # Unintuitive, but this is what happens on the main site
 
-        start       = DateTime(str(task['startDate']))
-        startDate   = datetime(start.date.year, start.date.month, start.date.day)
+        start       = DateTime(str(startDate))
+        startDay    = datetime(start.date.year, start.date.month, start.date.day)
         current     = DateTime(-1)
         currentDate = datetime(current.date.year, current.date.month, current.date.day)
-        diff        = (currentDate - startDate)
+        diff        = (currentDate - startDay)
         # Taking care of offsets
         diffDay     = diff.days
-        if diffDay % (task['everyX']) == 0:
+        if diffDay % (everyX) == 0:
             return True
         else:
             return False
@@ -511,6 +513,7 @@ def HelpPage():
                    " ':et <taskname>' - Create a TODO with the given taskname. Put the name in quotes if it has multiple words. Empty taskname will prompt for a title",
                    " ':ed <taskname>' - Create a Daily with the given taskname. Put the name in quotes if it has multiple words. Empty taskname will prompt for a title",
                    " ':eh <taskname>' - Create a Habit with the given taskname. Put the name in quotes if it has multiple words. Empty taskname will prompt for a title",
+                   " ':import <file>' - Create all the tasks listed in a file, one per line in todo.txt style ('(A) text due:yyyy-mm-dd type:todo|daily|habit'), or a .csv file with columns text,type,difficulty,due",
                    "##########################################################",
                    "Modifying Tasks",
                    " ':set d [trivial|easy|medium|hard] - Change difficulty of a task",
@@ -520,12 +523,13 @@ def HelpPage():
                    " ':set direction [both|pos|neg|none] - Set the directions for a habit (both means both pos and neg)",
                    "##########################################################",
                    "Managing Changes",
-                   " ':w' - Flush all the mark/deletion/edit changes and push them onto the server",
+                   " ':w' - Flush all the mark/deletion/edit changes and push them onto the server. This happens in the background: a dot at the end of a task shows whether its changes are pending (yellow), sent (green) or failed (red)",
                    " ':r' - Reload data from the Habitica Server (similar to startup). Changes, if any, are not flushed forcibly)",
                    "##########################################################",
                    "Extra Tools",
                    " ':party' - Display information related to current party if any.",
                    " ':data-display' - Display useful information regarding damage, uncompleted dailies etc. Functions borrowed from the excellent Data-Display Tool by @LadyAlys",
+                   " ':stats' - Display latency, payload sizes, status codes and retries of the API calls made in this session. ':stats <file>' writes them to a file in JSON",
                    "##########################################################"
                    ]
 
@@ -536,3 +540,13 @@ def HelpPage():
     helpMenu.Display()
     helpMenu.Input()
     G.screen.RestoreRegister(1)
+
+def StatsPage():
+    stats_items = G.reqManager.stats.Lines()
+    stats_items = [M.SimpleTextItem(i) for i in stats_items]
+    G.screen.SaveInRegister(1)
+    statsMenu = M.SimpleTextMenu(stats_items, C.SCR_TEXT_AREA_LENGTH)
+    statsMenu.SetXY(C.SCR_FIRST_HALF_LENGTH, 5)
+    statsMenu.Display()
+    statsMenu.Input()
+    G.screen.RestoreRegister(1)
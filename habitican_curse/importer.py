@@ -0,0 +1,126 @@
+""" Module "Importer" : Bulk task import
+
+    Reads tasks from a file and turns them into task objects for the
+    CreateTask API call. Two formats are understood:
+
+    * todo.txt style (default): one task per line, e.g.
+          (A) Pay the rent due:2016-07-01
+          Water the plants type:daily
+      A leading priority (A)-(D) maps to hard, medium, easy and trivial,
+      'due:' sets the due date of a TODO and 'type:' picks todo, daily or
+      habit. Blank lines, '#' comments and completed ('x ') lines are skipped.
+
+    * CSV (files ending in .csv): text,type,difficulty,due with an optional
+      header row. Only the text column is required.
+"""
+# Standard Library Imports
+import os
+import re
+import csv
+from datetime import datetime, timedelta
+
+# Custom Module Imports
+import config as C
+import helper as H
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+PRIORITY_TO_DIFF = {'A': "hard", 'B': "medium", 'C': "easy", 'D': "trivial"}
+DIFF_TO_PRIORITY = {"trivial": 0.1, "easy": 1, "medium": 1.5, "hard": 2}
+TASK_TYPES = ["todo", "daily", "habit"]
+
+TODOTXT_PRIORITY = re.compile(r'^\(([A-Z])\)\s+')
+TODOTXT_TAG      = re.compile(r'(?:^|\s)(due|type):(\S+)')
+
+
+def ParseDueDate(string):
+    # Due dates are set to the end of the given day, as in H.DatePicker
+    for dateFormat in ["%Y-%m-%d"] + C.DATEFORMATS:
+        try:
+            date = datetime.strptime(string, dateFormat)
+        except ValueError:
+            continue
+        return H.DateTime(date + timedelta(hours=23, minutes=59, seconds=59)).ConvertUTC()
+
+    raise ValueError("Invalid due date %s" % string)
+
+
+def TaskObject(text, task_type="todo", difficulty="easy", due=""):
+    if task_type not in TASK_TYPES:
+        raise ValueError("Unknown task type %s" % task_type)
+    if difficulty not in DIFF_TO_PRIORITY:
+        raise ValueError("Unknown difficulty %s" % difficulty)
+
+    task = {}
+    task['text'] = text.decode("utf-8")
+    task['type'] = task_type
+    task['priority'] = DIFF_TO_PRIORITY[difficulty]
+
+    if task_type == 'todo' or task_type == 'daily':
+        task['checklist'] = []
+    if task_type == "daily":
+        task['everyX'] = 1
+        task['frequency'] = 'weekly'
+        task['repeat'] = C.DEFAULT_REPEAT.copy()
+    if task_type == "habit":
+        task['up'] = True
+        task['down'] = True
+    if task_type == "todo" and due != "":
+        task['date'] = ParseDueDate(due)
+
+    return task
+
+
+def ParseTodoTxtLine(line):
+    line = line.strip()
+    if line == "" or line.startswith("#") or line.startswith("x "):
+        return None
+
+    difficulty = "easy"
+    match = TODOTXT_PRIORITY.match(line)
+    if match:
+        difficulty = PRIORITY_TO_DIFF.get(match.group(1), "trivial")
+        line = line[match.end():]
+
+    tags = dict(TODOTXT_TAG.findall(line))
+    text = TODOTXT_TAG.sub("", line).strip()
+
+    return TaskObject(text, tags.get('type', "todo"), difficulty, tags.get('due', ""))
+
+
+def ParseCSVRow(row):
+    row = [i.strip() for i in row] + [""]*3
+    if row[0] == "" or row[0].lower() == "text":   # Empty row or header
+        return None
+
+    return TaskObject(row[0], row[1] or "todo", row[2] or "easy", row[3])
+
+
+def ReadTaskFile(fileName):
+    # Returns the list of task objects; raises IOError/ValueError with the
+    # offending line number on bad input
+    fileName = os.path.expanduser(fileName)
+    tasks = []
+
+    with open(fileName, 'r') as f:
+        if fileName.lower().endswith(".csv"):
+            rows = csv.reader(f)
+            parse = ParseCSVRow
+        else:
+            rows = f
+            parse = ParseTodoTxtLine
+
+        for (lineNo, row) in enumerate(rows, 1):
+            try:
+                task = parse(row)
+            except ValueError as e:
+                raise ValueError("Line %d: %s" % (lineNo, str(e)))
+
+            if task is not None:
+                tasks.append(task)
+
+    logger.debug("Read %d tasks from %s" % (len(tasks), fileName))
+    return tasks
@@ -4,6 +4,7 @@
 """
 # Standard Library Imports
 import curses
+import datetime
 import shlex # For parsing
 
 # Custom Module Imports
@@ -14,6 +15,8 @@ import helper as H
 import menu as M
 import debug as DEBUG
 import content as CT
+import importer as IM
+import workers as W
 
 #Set up logging
 import logging
@@ -34,14 +37,23 @@ class Interface(object):
         self.trinity = []
         self.currentMenu = 0
 
-    def Init(self):
+        # Results of background operations, handled by the input loop
+        self.dispatcher = W.Dispatcher()
+
+        # Latest (tasks, user) from the background refresh, not applied yet
+        self.pendingRefresh = None
+
+    # With keepPosition, the scroll positions and the selected menu/task are
+    # kept (used after an incremental reload)
+    def Init(self, keepPosition=False):
         G.HabitMenu.SetXY(1, 2)
         G.DailyMenu.SetXY(1, 6 + C.SCR_MENU_ITEM_WIDTH)
         G.TODOMenu.SetXY(1, 10 + 2*C.SCR_MENU_ITEM_WIDTH)
 
-        G.HabitMenu.Reload()
-        G.DailyMenu.Reload()
-        G.TODOMenu.Reload()
+        if not keepPosition:
+            G.HabitMenu.Reload()
+            G.DailyMenu.Reload()
+            G.TODOMenu.Reload()
 
         G.HabitMenu.Init()
         G.DailyMenu.Init()
@@ -59,6 +71,11 @@ class Interface(object):
 
         # Used for scrolling
         self.trinity = [G.HabitMenu, G.DailyMenu, G.TODOMenu]
+        if keepPosition and not self.trinity[self.currentMenu].IsEmpty():
+            self.trinity[self.currentMenu].InitialCurrentTask()
+            self.Highlight()
+            return
+
         self.currentMenu = 0
         for i in xrange(0, 3):
             if not self.trinity[i].IsEmpty():
@@ -111,6 +128,7 @@ class Interface(object):
 
         G.currentTask.ToggleMarkUp()
         G.currentTask.HighlightName()
+        self.ShowPrediction()
 
     # For marking habits as "-"
     def ToggleMarkDown(self):
@@ -119,6 +137,7 @@ class Interface(object):
 
         G.currentTask.ToggleMarkDown()
         G.currentTask.HighlightName()
+        self.ShowPrediction()
 
     # For marking tasks and dailies as completed
     def ToggleMark(self):
@@ -127,6 +146,13 @@ class Interface(object):
 
         G.currentTask.ToggleMark()
         G.currentTask.HighlightName()
+        self.ShowPrediction()
+
+    # Predicted effect of the marked tasks on the stats (see scoring)
+    def ShowPrediction(self):
+        stats = G.reqManager.PredictPending()
+        if stats is not None:
+            G.user.PrintPrediction(stats)
 
     # For marking tasks for deletion
     def ToggleDelete(self):
@@ -277,6 +303,50 @@ class Interface(object):
             self.Highlight()
             return
 
+        elif Idx(parsed, 0) == "import": # Create tasks from a file
+
+            if Idx(parsed, 1) == "":
+                DEBUG.Display("Usage: import <file>")
+                return
+
+            try:
+                tasks = IM.ReadTaskFile(Idx(parsed, 1))
+            except (IOError, ValueError) as e:
+                DEBUG.Display("Import failed: " + str(e))
+                return
+
+            DEBUG.Display("Importing %d tasks..." % len(tasks))
+            created, failed = G.reqManager.ImportTasks(tasks)
+
+            # A single redraw once every batch is back
+            G.prevTask = None
+            G.currentTask = None
+            G.screen.Erase()
+            self.Init(keepPosition=True)
+            if G.user.attrStats:
+                G.user.PrintUserStats()
+
+            if failed:
+                DEBUG.Display("Imported %d tasks, %d could not be created" % (created, failed))
+            else:
+                DEBUG.Display("Imported %d tasks" % created)
+            return
+
+        elif Idx(parsed, 0) == "stats": # API call statistics
+
+            if Idx(parsed, 1) == "":
+                H.StatsPage()
+                return
+
+            try:
+                fileName = G.reqManager.stats.Dump(Idx(parsed, 1))
+            except IOError as e:
+                DEBUG.Display("Could not write statistics: " + str(e))
+                return
+
+            DEBUG.Display("Statistics written to " + fileName)
+            return
+
         if command != "":
             DEBUG.Display("Invalid: " + command)
 
@@ -284,17 +354,13 @@ class Interface(object):
     def Command(self, command):
         if command == "w":
             self.FlushChangesToQueue() #Write out things to the request queue
-            G.reqManager.Flush() #Send the queue
+            G.reqManager.FlushAsync() #Send the queue in the background
 
         elif command == "r":
             self.FlushChangesToQueue()
             G.prevTask = None
             G.currentTask = None
-            if(len(G.reqManager.MarkUpQueue) |
-               len(G.reqManager.MarkDownQueue) |
-               len(G.reqManager.MarkQueue) |
-               len(G.reqManager.DeleteQueue) |
-               len(G.reqManager.EditQueue) ):
+            if self.PendingWrites():
                 DEBUG.Display("Some writes are pending (add ! to ignore and reload anyway)")
                 return
            
@@ -304,20 +370,19 @@ class Interface(object):
             G.prevTask = None
             G.currentTask = None
             self.FlushChangesToQueue()
+            if G.reqManager.Flushing():
+                DEBUG.Display("Changes are still being written, reload once they are done")
+                return
+
             G.reqManager.ClearQueues()
-            G.reqManager.FetchData()
+            G.reqManager.ReloadData()
             G.screen.Erase()
-            self.Init()
+            self.Init(keepPosition=True)
 
-            # User Stats
-            while (G.content == None):
-                DEBUG.Display("Fetching Content...")
-                time.sleep(5)
-            DEBUG.Display(" ")
-
-            G.user.attrStats = H.GetUserStats(G.user.data)
-
-            G.user.PrintUserStats()
+            # User Stats, or once the content is there (see OnContent)
+            if G.content is not None:
+                G.user.attrStats = H.GetUserStats(G.user.data)
+                G.user.PrintUserStats()
 
         elif command == "party":
             G.screen.SaveInRegister(1)
@@ -333,6 +398,135 @@ class Interface(object):
         else:
             self.Parser(command)
 
+    # Local changes not sent to the server yet (marked, queued or being
+    # written in the background)
+    def PendingWrites(self):
+        if G.reqManager.Flushing():
+            return True
+
+        if(len(G.reqManager.MarkUpQueue) |
+           len(G.reqManager.MarkDownQueue) |
+           len(G.reqManager.MarkQueue) |
+           len(G.reqManager.DeleteQueue) |
+           len(G.reqManager.EditQueue) ):
+            return True
+
+        for menu in self.trinity:
+            for i in menu.items:
+                if [j for j in i.status.attributes.values() if j]:
+                    return True
+        return False
+
+    # Called on the refresher thread with freshly fetched data
+    def OnRefresh(self, task_json, user_json):
+        self.dispatcher.Post(self.QueueRefresh, task_json, user_json)
+
+    def QueueRefresh(self, task_json, user_json):
+        self.pendingRefresh = (task_json, user_json)
+
+    # Whether a refresh has to wait: it would clobber local changes, or it
+    # may or may not include a write in progress. Marks made on the data of
+    # the snapshot are kept by the refresh.
+    def HoldRefresh(self):
+        if G.reqManager.Flushing():
+            return True
+        return self.PendingWrites() and not G.stale
+
+    # Swap in the data of the background refresh. If it has to wait, it is
+    # dropped and fetched once more when the local changes are written (see
+    # Input); by then it would be out of date anyway.
+    def ApplyRefresh(self):
+        task_json, user_json = self.pendingRefresh
+        self.pendingRefresh = None
+
+        if self.HoldRefresh():
+            G.reqManager.refreshAfterWrites = True
+            return
+
+        G.LastUpdate = datetime.datetime.now()
+        G.stale = False
+        G.reqManager.ApplyTaskDelta(task_json)
+        G.user.Reload(user_json)
+        G.reqManager.SaveSnapshot(task_json, user_json)
+        self.Redraw()
+
+        # Write held back while the snapshot was shown
+        if G.reqManager.flushAfterRevalidation:
+            G.reqManager.FlushAsync()
+
+    # Redraw the whole screen, keeping the selection
+    def Redraw(self):
+        G.prevTask = None
+        G.currentTask = None
+        G.screen.Erase()
+        self.Init(keepPosition=True)
+        if G.user.attrStats:
+            G.user.PrintUserStats()
+        G.user.RedisplayDiff()
+
+    # Redraw a single task row, if it is scrolled into view
+    def RedrawItem(self, item):
+        for menu in self.trinity:
+            if not menu.IsVisible(item):
+                continue
+
+            if item is G.currentTask:
+                item.HighlightName()
+            else:
+                item.DisplayName()
+
+    # Load the game content in the background
+    def LoadContent(self):
+        G.contentFuture = G.reqManager.GameContent()
+        self.dispatcher.OnDone(G.contentFuture, self.OnContent)
+
+    # Fill in the stats bar once the content is there
+    def OnContent(self, future):
+        if future is not G.contentFuture:
+            return
+
+        if future.Failed():
+            logger.warn("Could not load the game content: %s" % str(future.error))
+            return
+
+        G.content = future.Result()
+        G.user.attrStats = H.GetUserStats(G.user.data)
+        G.user.PrintUserStats()
+
+    # The game content, waiting for it if it is still being loaded (and
+    # loading it again if that failed). None if the wait was cancelled or
+    # the content could not be loaded.
+    def WaitForContent(self):
+        if G.content is not None:
+            return G.content
+
+        if G.contentFuture is None or G.contentFuture.Failed():
+            self.LoadContent()
+
+        try:
+            content = self.Await(G.contentFuture, "Fetching Content...")
+        except Exception as e:
+            DEBUG.Display("Could not load the game content: %s" % str(e))
+            return None
+
+        if content is not None:
+            G.content = content
+        return content
+
+    # Wait for a background operation (a W.Future) while still handling the
+    # results of the others. Escape stops waiting and returns None; the
+    # operation itself carries on. Errors of the operation are raised.
+    def Await(self, future, message="Please Wait..."):
+        DEBUG.Display(message)
+        while not future.Done():
+            self.dispatcher.RunPending()
+            if G.screen.GetCharacter(C.INPUT_POLL_INTERVAL) == 27:
+                DEBUG.Display("Cancelled")
+                return None
+
+        DEBUG.Display(" ")
+        return future.Result()
+
     def Input(self):
         while(1):
             try:
@@ -341,7 +535,17 @@ class Interface(object):
             except:
                 pass
 
-            c = G.screen.GetCharacter()
+            self.dispatcher.RunPending()
+            if self.pendingRefresh is not None:
+                self.ApplyRefresh()
+            elif G.reqManager.refreshAfterWrites and not self.HoldRefresh():
+                G.reqManager.refreshAfterWrites = False
+                G.reqManager.Revalidate(self.OnRefresh)
+
+            c = G.screen.GetCharacter(C.INPUT_POLL_INTERVAL)
+            if c == -1:
+                # No key pressed, go back to handling background results
+                continue
 
             # Clear Notification Line
             DEBUG.Display(" ")
@@ -373,17 +577,17 @@ class Interface(object):
 
                 if command == "wq":
                     self.FlushChangesToQueue() #Write out things to the request queue
-                    G.reqManager.Flush() #Send the queue
+                    if not G.reqManager.Flush(): #Send the queue
+                        continue #Still queued, see Flush
                     break
 
                 if command == "q":
                     self.FlushChangesToQueue()
 
-                    if(len(G.reqManager.MarkUpQueue) |
-                       len(G.reqManager.MarkDownQueue) |
-                       len(G.reqManager.MarkQueue) |
-                       len(G.reqManager.DeleteQueue) |
-                       len(G.reqManager.EditQueue) ):
+                    if G.reqManager.Flushing():
+                        DEBUG.Display("Changes are still being written (add ! to override)")
+                        continue
+                    if self.PendingWrites():
                         DEBUG.Display("No write since last change (add ! to override)")
                         continue #Restart command loop
                     break #exit
@@ -0,0 +1,112 @@
+""" Module "Journal" : Write-ahead log of pending task operations
+
+    Operations are appended to an on-disk journal before being sent to the
+    server and acknowledged once the server has accepted them. Entries which
+    were never acknowledged (network failure, crash, Ctrl-C) are replayed on
+    the next flush or launch.
+"""
+# Standard Library Imports
+import os
+import json
+import uuid
+import threading
+
+# Custom Module Imports
+import config as C
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+JOURNAL_FILE = "journal.log"
+
+# Fields of an operation (see RequestManager.QueuedOperations) worth keeping
+JOURNAL_FIELDS = ['kind', 'task', 'direction', 'value', 'body']
+
+
+class Journal(object):
+    """ Append-only log with one JSON record per line. A record is either an
+    operation entry (with an 'id') or an acknowledgement {'ack': id} """
+
+    def __init__(self, fileName=None):
+        if fileName is None:
+            fileName = C.getDataFile(JOURNAL_FILE)
+
+        self.fileName = fileName
+        self.lock = threading.Lock()
+
+    def Write(self, records):
+        with open(self.fileName, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def Append(self, ops):
+        # Give each operation a journal id and persist them in one go
+        records = []
+        for op in ops:
+            op['journal'] = str(uuid.uuid4())
+            record = dict((i, op[i]) for i in JOURNAL_FIELDS if i in op)
+            record['id'] = op['journal']
+            records.append(record)
+
+        with self.lock:
+            self.Write(records)
+
+    def Ack(self, op):
+        with self.lock:
+            self.Write([{'ack': op['journal']}])
+
+    def Pending(self):
+        # Operations without an acknowledgement, in the order they were added
+        entries = []
+        acked = set()
+
+        with self.lock:
+            try:
+                f = open(self.fileName, 'r')
+            except IOError:
+                return []
+
+            with f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash
+                        logger.warn("Ignoring corrupt journal record")
+                        continue
+
+                    if 'ack' in record:
+                        acked.add(record['ack'])
+                    else:
+                        entries.append(record)
+
+        ops = []
+        for record in entries:
+            if record['id'] in acked:
+                continue
+            op = dict((i, record[i]) for i in JOURNAL_FIELDS if i in record)
+            op['journal'] = record['id']
+            ops.append(op)
+
+        return ops
+
+    def Compact(self):
+        # Rewrite the journal with only the unacknowledged entries
+        pending = self.Pending()
+
+        with self.lock:
+            tmpName = self.fileName + ".tmp"
+            with open(tmpName, 'w') as f:
+                for op in pending:
+                    record = dict((i, op[i]) for i in JOURNAL_FIELDS if i in op)
+                    record['id'] = op['journal']
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpName, self.fileName)
+
+        return pending
@@ -27,9 +27,32 @@ class MenuItem(object):
 
     def __init__(self, task, task_type, taskname,
                  width = -1, front = True):
-        self.task = task
         self.task_type = task_type
+        self.SetTask(task, taskname)
+
+        # State of the changes being written in the background: None,
+        # 'pending', 'sent' or 'failed' (see RequestManager.FlushAsync)
+        self.sync = None
+
+        self.x = 0
+        self.y = 0
+
+        # Width specification
+        if width == -1:
+            self.width = C.SCR_MENU_ITEM_WIDTH
+        else:
+            self.width = width
+
+        # Should the status be at the front or the back (True/False
+        # respectively)
+        self.front = front
+
 
+    def SetTask(self, task, taskname=None):
+        # Also used to swap in a fresh copy of the task after a reload
+        self.task = task
+        if taskname is None:
+            taskname = task.text
         self.taskname = taskname
 
         if self.task_type == "habit":
@@ -62,21 +85,6 @@ class MenuItem(object):
         else: # task_type = 'checklist'
             self.status = H.Status(self.task_type)
 
-
-        self.x = 0
-        self.y = 0
-
-        # Width specification
-        if width == -1:
-            self.width = C.SCR_MENU_ITEM_WIDTH
-        else:
-            self.width = width
-
-        # Should the status be at the front or the back (True/False
-        # respectively)
-        self.front = front
-
-
     def SetXY(self, x=0, y=0):
         self.x = x
         self.y = y
@@ -112,6 +120,11 @@ class MenuItem(object):
         # Show the attributes that can be set (mark,delete, up,down,etc)
         self.status.Display()
 
+        # Write-behind state, in the last cell of the second row
+        if self.sync is not None:
+            G.screen.Display(C.SYMBOL_DISC, self.x+1, self.y+self.width-1,
+                    color=C.SYNC_COLORS[self.sync], bold=True)
+
         #Add a gray tick if it's completed
         if hasattr(self.task, 'completed') and self.task.completed:
             G.screen.Display(C.SYMBOL_TICK, self.x,self.y + status_length,
@@ -432,11 +445,37 @@ class Menu(object):
         self.end = min(self.rows/2, len(self.items))
         self.current = 0 # Current task number
 
-    def Remove(self, ID):
+    def Replace(self, items):
+        # Swap in a new list of items, keeping the selected task and its
+        # place in the window where possible
+        currentID = None
+        if self.current < len(self.items):
+            currentID = self.items[self.current].task.taskID
+        offset = self.current - self.start
+
+        self.items = items
+        IDs = [i.task.taskID for i in self.items]
+        if currentID in IDs:
+            self.current = IDs.index(currentID)
+        else:
+            self.current = max(min(self.current, len(self.items) - 1), 0)
+
+        window = self.rows/2
+        self.start = max(min(self.current - offset, len(self.items) - window), 0)
+        self.end = min(self.start + window, len(self.items))
+
+    def Find(self, ID):
         for i in self.items:
             if i.task.taskID == ID:
-                self.items.remove(i)
-                break
+                return i
+        return None
+
+    def Remove(self, ID):
+        # Keeps the selected task and the window in range (see Replace)
+        self.Replace([i for i in self.items if i.task.taskID != ID])
+
+    def IsVisible(self, item):
+        return item in self.items[self.start:self.end]
 
     def Insert(self, item):
         self.items.insert(0, item)
@@ -475,21 +514,21 @@ class Menu(object):
             if i.status.attributes.get(C.SYMBOL_TICK, False):
                 anyChange = True
                 i.task.Mark()
-                newChecklist += [i.task.data]
+                newChecklist += [i.task.ToJSON()]
                 newItems += [i]
             elif i.status.attributes.get(C.SYMBOL_DELETE, False):
                 anyChange = True
             elif i.status.attributes.get(C.SYMBOL_EDIT, False): # Name Change
                 anyChange = True
                 i.task.ChangeName()
-                newChecklist += [i.task.data]
+                newChecklist += [i.task.ToJSON()]
                 newItems += [i]
             elif i.status.IsNewItem():
                 anyChange = True
-                newChecklist += [i.task.data]
+                newChecklist += [i.task.ToJSON()]
                 newItems += [i]
             else:
-                newChecklist += [i.task.data]
+                newChecklist += [i.task.ToJSON()]
                 newItems += [i]
 
             i.status.Reset()
@@ -522,7 +561,8 @@ class Menu(object):
 
 class SimpleTextItem(object):
     """ Simple scrollable text menu. Used for displaying party chats,
-    drop messages etc. """
+    drop messages etc. The text is only wrapped when it is displayed, once
+    per width """
 
     def __init__(self, string, width=-1, additional=''):
         if width == -1:
@@ -530,13 +570,31 @@ class SimpleTextItem(object):
 
         self.width = width
         self.string = string
+        self.additional = additional
+        self.wraps = {}                  # Width -> wrapped lines
+
+    def Additional(self):
+        # Shown in gray above the text; may be given as a function
+        if callable(self.additional):
+            return self.additional()
+        return self.additional
 
-        self.wrap  = textwrap.wrap(string, self.width)
+    def Wrap(self, width=None):
+        if width is None:
+            width = self.width
 
-        if additional != '':
-            self.additional_wrap = textwrap.wrap(additional, self.width)
-            self.additional_wrap = ['#'+i for i in self.additional_wrap]
-            self.wrap = self.additional_wrap + self.wrap
+        if width not in self.wraps:
+            wrap = textwrap.wrap(self.string, width)
+            additional = self.Additional()
+            if additional != '':
+                wrap = ['#'+i for i in textwrap.wrap(additional, width)] + wrap
+            self.wraps[width] = wrap
+
+        return self.wraps[width]
+
+    @property
+    def wrap(self):
+        return self.Wrap()
 
     def ReturnNumLines(self):
         return len(self.wrap) + 2   # Plus the number of border lines
@@ -545,31 +603,74 @@ class SimpleTextItem(object):
 
 class SimpleTextMenu(object):
     """ Simple scrollable text menu. Used for displaying party chats,
-    drop messages etc. """
+    drop messages etc. Items are wrapped as they are scrolled into view;
+    more() is called for further items when scrolling past the last one """
 
-    def __init__(self, items, num_rows=-1):
+    def __init__(self, items, num_rows=-1, more=None):
 
         if num_rows == -1:
             num_rows = C.SCR_MAX_MENU_ROWS
 
         self.num_rows = num_rows
 
-        self.items = items
-        self.text = []
+        self.items = list(items)
+        self.more = more
+        self.width = self.items[0].width if self.items else C.SCR_Y - 20
 
-        self.text += ["-"*(self.items[0].width)] # Border Line
-        for i in self.items:
-            self.text += i.wrap
-            self.text += ["-"*(i.width)] # Border Line
+        self.text = ["-"*(self.width)] # Border Line
+        self.wrapped = 0               # Items whose lines are in self.text
 
         # Menu Window Specifications
         self.start = 0
+        self.FillTo(2*self.num_rows)
         self.end = min(self.num_rows, len(self.text))
 
         # Coordinates
         self.x = 0
         self.y = 0
 
+    def FillTo(self, numLines):
+        # Wrap items until there are numLines lines. Returns False if there
+        # are not that many.
+        while len(self.text) < numLines:
+            if self.wrapped == len(self.items):
+                items = self.more() if self.more is not None else None
+                if not items:
+                    self.more = None
+                    return False
+                self.items += items
+
+            self.text += self.items[self.wrapped].Wrap(self.width)
+            self.text += ["-"*(self.width)] # Border Line
+            self.wrapped += 1
+
+        return True
+
+    def Length(self):
+        # Number of lines, estimated from the wrapped items while some are
+        # still left
+        if self.wrapped == 0 or self.wrapped == len(self.items):
+            return len(self.text) + (1 if self.more is not None else 0)
+        return len(self.text)*len(self.items)/self.wrapped
+
+    def Prepend(self, items):
+        # Add items above the first one. The window stays on the same lines,
+        # unless it is at the top.
+        lines = []
+        for i in items:
+            lines += i.Wrap(self.width)
+            lines += ["-"*(self.width)] # Border Line
+
+        self.items = list(items) + self.items
+        self.wrapped += len(items)
+        self.text = self.text[:1] + lines + self.text[1:]
+
+        if self.start > 0:
+            self.start += len(lines)
+            self.end += len(lines)
+        else:
+            self.end = min(self.num_rows, len(self.text))
+
     def SetXY(self, x=0, y=0):
         self.x = x
         self.y = y
@@ -579,13 +680,14 @@ class SimpleTextMenu(object):
 
         # Menu Window Specifications
         self.start = 0
+        self.FillTo(2*self.num_rows)
         self.end = min(self.num_rows, len(self.text))
 
     def Display(self):
         G.screen.ClearRegion(self.x, self.x+self.num_rows, self.y, C.SCR_Y-1)
         X, Y = self.x, self.y
 
-        G.screen.ScrollBar(X, C.SCR_Y-5, self.start, self.end, len(self.text), self.num_rows)
+        G.screen.ScrollBar(X, C.SCR_Y-5, self.start, self.end, self.Length(), self.num_rows)
 
         for i in xrange(self.start, self.end):
             if self.text[i][:3] == "---" or self.text[i][0] == "#":
@@ -597,30 +699,48 @@ class SimpleTextMenu(object):
                         color=C.SCR_COLOR_WHITE, bold=True)
                 X += 1
 
-    def ScrollUp(self):
-        if self.start == 0:
+    def Scroll(self, lines):
+        # Move the window by up to that many lines (negative: up), keeping
+        # the next page wrapped ahead
+        if lines > 0:
+            self.FillTo(self.end + lines + self.num_rows)
+            lines = min(lines, len(self.text) - self.end)
+        else:
+            lines = max(lines, -self.start)
+
+        if lines == 0:
             return
 
-        self.start -= 1
-        self.end -= 1
+        self.start += lines
+        self.end += lines
         self.Display()
 
-    def ScrollDown(self):
-        if self.end == len(self.text):
-            return
+    def ScrollUp(self):
+        self.Scroll(-1)
 
-        self.start += 1
-        self.end += 1
-        self.Display()
+    def ScrollDown(self):
+        self.Scroll(1)
 
-    def Input(self):
+    def Input(self, idle=None):
+        # idle() is called whenever no key was pressed for a short while
         DEBUG.Display("Press q to exit...")
         while(1):
-            c = G.screen.GetCharacter()
+            if idle is None:
+                c = G.screen.GetCharacter()
+            else:
+                c = G.screen.GetCharacter(C.INPUT_POLL_INTERVAL)
+                if c == -1:
+                    idle()
+                    continue
+
             if c == curses.KEY_UP or c == ord('k'):
                 self.ScrollUp()
             elif c == curses.KEY_DOWN or c == ord('j'):
                 self.ScrollDown()
+            elif c == curses.KEY_PPAGE:
+                self.Scroll(-self.num_rows)
+            elif c == curses.KEY_NPAGE:
+                self.Scroll(self.num_rows)
             elif c == 27 or c == ord('q'):
                 break
 
@@ -0,0 +1,178 @@
+""" Module "Metrics" : Statistics of the API calls made in a session
+
+    Every request to the Habitica server is recorded per endpoint (method
+    and path, with task ids folded into ':id'): a latency histogram, the
+    time spent waiting for the rate limiter, waiting for the response
+    headers (network + server) and reading the body, the time spent decoding
+    it, payload sizes, status codes and retries.
+"""
+# Standard Library Imports
+import os
+import re
+import time
+import json
+import threading
+
+# Custom Module Imports
+import config as C
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket
+# holds everything slower.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+STATS_FILE = "stats.json"
+
+TASK_ID = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+
+def Endpoint(method, path):
+    return "%s %s" % (method.upper(), TASK_ID.sub(":id", path))
+
+def FormatSize(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return "%d%s" % (size, unit)
+        size /= 1024.0
+    return "%dGB" % size
+
+
+class EndpointStats(object):
+    """ Counters of a single endpoint """
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.status = {}                 # Status code (or error name) -> count
+        self.buckets = [0]*(len(LATENCY_BUCKETS) + 1)
+
+        # Total times in seconds
+        self.latency = 0.0               # Whole request, as seen by the caller
+        self.maxLatency = 0.0
+        self.queued = 0.0                # Held back by the rate limiter
+        self.headers = 0.0               # Until the response headers arrived
+        self.decode = 0.0                # JSON decoding
+
+        self.sent = 0                    # Bytes
+        self.received = 0
+
+    def Record(self, latency, status, queued=0.0, headers=0.0, sent=0, received=0):
+        self.calls += 1
+        self.status[status] = self.status.get(status, 0) + 1
+
+        bucket = len(LATENCY_BUCKETS)
+        for (i, bound) in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                bucket = i
+                break
+        self.buckets[bucket] += 1
+
+        self.latency += latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.queued += queued
+        self.headers += headers
+        self.sent += sent
+        self.received += received
+
+    def Percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of the calls
+        # (None for the open-ended last bucket)
+        rank = fraction*self.calls
+        seen = 0
+        for (i, count) in enumerate(self.buckets):
+            seen += count
+            if count > 0 and seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+        return None
+
+    def Summary(self):
+        calls = max(self.calls, 1)
+        return {'calls': self.calls,
+                'retries': self.retries,
+                'status': dict((str(i), j) for (i, j) in self.status.items()),
+                'histogram': dict(zip([str(i) for i in LATENCY_BUCKETS] + ["inf"], self.buckets)),
+                'avg_latency': self.latency/calls,
+                'max_latency': self.maxLatency,
+                'avg_queued': self.queued/calls,
+                'avg_headers': self.headers/calls,
+                'avg_body': max(self.latency - self.headers, 0)/calls,
+                'avg_decode': self.decode/calls,
+                'bytes_sent': self.sent,
+                'bytes_received': self.received}
+
+
+class Metrics(object):
+    """ Per-endpoint statistics for the session, safe to update from the
+    worker threads """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+
+    def Get(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    def Record(self, endpoint, latency, status, queued=0.0, headers=0.0, sent=0, received=0):
+        with self.lock:
+            self.Get(endpoint).Record(latency, status, queued, headers, sent, received)
+
+    def Retry(self, endpoint):
+        with self.lock:
+            self.Get(endpoint).retries += 1
+
+    def Decoded(self, endpoint, seconds):
+        with self.lock:
+            self.Get(endpoint).decode += seconds
+
+    def Summary(self):
+        with self.lock:
+            return {'started': self.started,
+                    'duration': time.time() - self.started,
+                    'endpoints': dict((i, j.Summary()) for (i, j) in self.endpoints.items())}
+
+    def Lines(self):
+        # Human-readable report for the :stats view, slowest endpoints first
+        summary = self.Summary()
+        endpoints = sorted(summary['endpoints'].items(),
+                           key=lambda i: i[1]['avg_latency']*i[1]['calls'], reverse=True)
+
+        lines = ["Session: %d calls in %d minutes" %
+                 (sum([i['calls'] for (_, i) in endpoints]), summary['duration']/60)]
+
+        for (endpoint, stats) in endpoints:
+            with self.lock:
+                p50 = self.endpoints[endpoint].Percentile(0.5)
+                p95 = self.endpoints[endpoint].Percentile(0.95)
+
+            lines.append("%s - %d calls, %d retries, status %s" %
+                         (endpoint, stats['calls'], stats['retries'],
+                          ", ".join(["%s:%d" % i for i in sorted(stats['status'].items())])))
+            lines.append(" latency avg %dms, max %dms, p50 %s, p95 %s" %
+                         (stats['avg_latency']*1000, stats['max_latency']*1000,
+                          "<=%gs" % p50 if p50 is not None else ">%gs" % LATENCY_BUCKETS[-1],
+                          "<=%gs" % p95 if p95 is not None else ">%gs" % LATENCY_BUCKETS[-1]))
+            lines.append(" avg queued %dms, headers %dms, body %dms, decode %dms" %
+                         (stats['avg_queued']*1000, stats['avg_headers']*1000,
+                          stats['avg_body']*1000, stats['avg_decode']*1000))
+            lines.append(" sent %s, received %s" %
+                         (FormatSize(stats['bytes_sent']), FormatSize(stats['bytes_received'])))
+
+        return lines
+
+    def Dump(self, fileName=None):
+        if fileName is None:
+            fileName = C.getDataFile(STATS_FILE)
+        fileName = os.path.expanduser(fileName)
+
+        with open(fileName, 'w') as f:
+            json.dump(self.Summary(), f, indent=2, sort_keys=True)
+
+        logger.debug("API statistics written to %s" % fileName)
+        return fileName
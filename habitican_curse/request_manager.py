@@ -4,10 +4,17 @@
 """
 # Standard Library Imports
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import time
 import imp
 import importlib
 import datetime
+import itertools
+import random
+import uuid
+from collections import OrderedDict
+from requests.packages.urllib3.exceptions import NewConnectionError
 
 # Custom Module Imports
 
@@ -19,21 +26,106 @@ import menu as M
 import task as T
 import debug as DEBUG
 import user as U
+import workers as W
+import journal as J
+import importer as IM
+import scheduler as S
+import metrics as MT
+import scoring as SC
+import snapshot as SN
 
 #Set up logging
 import logging
 logger = logging.getLogger(__name__)
 logger.debug("Debug logging started for %s..." % __name__)
 
-# URL Definitions
+# URL Definitions ("api_url" in ~/.habiticarc points the app at another
+# server, e.g. the local stand-in in stub_server.py)
 API_URL = "https://habitica.com:443/api/v3"
+if C.getConfig("api_url") is not None:
+    API_URL = C.getConfig("api_url").rstrip("/")
 
 #Request Methods
-request_methods = dict()
-request_methods['get'] = requests.get
-request_methods['put'] = requests.put
-request_methods['post'] = requests.post
-request_methods['delete'] = requests.delete
+request_methods = ['get', 'put', 'post', 'delete']
+
+# Connection Pool Defaults (override with "pool_size" in ~/.habiticarc)
+POOL_SIZE = 10
+
+# Number of tasks flushed in parallel (override with "flush_workers")
+FLUSH_WORKERS = 4
+
+# Number of tasks created per request by ImportTasks
+IMPORT_BATCH_SIZE = 50
+
+# Seconds to wait for a connection to the server, and for it to answer
+# (override with "connect_timeout" and "read_timeout")
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT    = 30
+
+# How often a request rejected with 429 (Too Many Requests) is resent
+RATE_LIMIT_RETRIES = 3
+
+# Retries of transient failures (connection errors, 5xx), with exponential
+# backoff and full jitter: attempt n waits up to RETRY_BASE_DELAY*2^n seconds
+MAX_RETRIES      = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY  = 8
+
+# Methods which can be repeated without changing the outcome
+IDEMPOTENT_METHODS = ['get', 'put', 'delete']
+
+# Seconds before the data shown from the snapshot is revalidated again
+# after a failed attempt
+REVALIDATE_RETRY_DELAY = 30
+
+# Seconds between background checks for changes made by other clients
+# (override with "refresh_interval"; 0 turns the background refresh off)
+REFRESH_INTERVAL = 0
+
+
+class APIError(ValueError):
+    """ Error response from the Habitica server """
+
+    def __init__(self, status_code):
+        super(APIError, self).__init__("HTTP Response not recognized: %d" % status_code)
+        self.status_code = status_code
+
+    def IsPermanent(self):
+        # Client errors will fail the same way if the request is repeated
+        return 400 <= self.status_code < 500 and self.status_code != 429
+
+
+class Skipped(Exception):
+    """ Operation not sent because an earlier one on its task failed """
+
+    def __init__(self, op):
+        super(Skipped, self).__init__("Not sent after the failed %s on %s" % (op['kind'], op['task']))
+        self.op = op
+
+
+def NotSent(error):
+    # The connection could not even be opened, so the server never saw the
+    # request
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+def NotProcessed(error):
+    # The server refused the request before doing anything with it
+    if isinstance(error, APIError):
+        return error.status_code == 503
+    return NotSent(error)
+
+def IsTransient(error):
+    # Failures worth another try
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(error, APIError) and error.status_code >= 500
+
+def Backoff(attempt):
+    time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)))
 
 
 class RequestManager(object):
@@ -42,38 +134,198 @@ class RequestManager(object):
     def __init__(self):
 
         self.headers = {'x-api-key': C.getConfig("key"), 'x-api-user': C.getConfig("uuid")}
+        self.session = self.CreateSession()
+        self.timeout = (C.getConfigInt("connect_timeout", CONNECT_TIMEOUT),
+                        C.getConfigInt("read_timeout", READ_TIMEOUT))
+        self.workers = W.WorkerPool(C.getConfigInt("flush_workers", FLUSH_WORKERS))
+        self.transport = W.WorkerPool(C.getConfigInt("pool_size", POOL_SIZE))
+        self.scheduler = S.RateLimiter(C.getConfigInt("pool_size", POOL_SIZE))
+        self.journal = J.Journal()
+        self.stats = MT.Metrics()
         self.ClearQueues()
 
+        # Startup fetches in flight (see Prefetch)
+        self.userFuture = None
+        self.tasksFuture = None
+        self.contentFuture = None
 
-    # General Wrapper to fetch JSON data from server
-    def APIV3_call(self,path,params={},failure='hard',method='get',obj=None):
+        # Fetches confirming the data shown from the snapshot (see Revalidate)
+        self.revalidation = None
+
+        # A refresh was held back by local changes, fetch it again once they
+        # are written (see Interface.ApplyRefresh)
+        self.refreshAfterWrites = False
+
+        # Version (_v) of the user document the displayed data was fetched at
+        self.userVersion = None
+
+        # Write-behind flush in progress (see FlushAsync)
+        self.flushFuture = None
+        self.flushAgain = False
+
+        # Write requested while the data shown is from the snapshot
+        self.flushAfterRevalidation = False
+
+        # Open the first connection while the rest of the app starts up
+        self.warmUpThread = threading.Thread(target=self.WarmUp)
+        self.warmUpThread.daemon = True
+        self.warmUpThread.start()
+
+    # A single keep-alive session shared by all V3 calls, so that repeated
+    # calls (e.g. the scores in a Flush) reuse pooled connections instead of
+    # paying a fresh TCP+TLS handshake each time
+    def CreateSession(self):
+        pool_size = C.getConfigInt("pool_size", POOL_SIZE)
+
+        session = requests.Session()
+        session.headers.update(self.headers)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    # Establish a pooled connection to the server ahead of the first real call
+    def WarmUp(self):
+        try:
+            self.session.get(API_URL+"/status", timeout=self.timeout)
+            logger.debug("Connection pool warmed up")
+        except requests.exceptions.RequestException as e:
+            logger.warn("Connection warm-up failed: %s" % str(e))
+
+
+    # Send a request to the V3 API and return the raw response
+    # Transient failures are retried with backoff. Whether a request may be
+    # repeated is decided by 'idempotent' (by default: GET, PUT and DELETE).
+    # Other requests are only resent when the server cannot have processed
+    # them (connection refused, 503); any other failure is returned/raised
+    # and left to the caller (see CallOnce). With retry=False nothing is
+    # retried here, for callers which retry themselves.
+    def APIV3_request(self,path,params={},method='get',obj=None,headers=None,idempotent=None,retry=True):
 
         if method not in request_methods:
             raise ValueError("Unknown Method type ",method)
 
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
         url = API_URL+"/"+path
+        endpoint = MT.Endpoint(method, path)
+
+        # The query string is encoded by requests
+        logger.warn("Calling V3 API: %s %s" % (url, str(params) if params else ""))
+
+        retries = MAX_RETRIES if retry else 0
+        for attempt in xrange(retries + 1):
+            try:
+                resp = self.Send(method, url, params, obj, headers, endpoint)
+            except requests.exceptions.RequestException as e:
+                if attempt == retries or not IsTransient(e) or not (idempotent or NotSent(e)):
+                    raise
+                logger.warn("Retrying %s %s after error: %s" % (method, path, str(e)))
+            else:
+                if resp.status_code < 500 or attempt == retries:
+                    return resp
+                if not (idempotent or resp.status_code == 503):
+                    return resp
+                logger.warn("Retrying %s %s after HTTP %d" % (method, path, resp.status_code))
+
+            self.stats.Retry(endpoint)
+            Backoff(attempt)
+
+    # Requests are paced by the scheduler. A 429 means the server did not
+    # process the request, so it is always safe to send it again.
+    # Every attempt is recorded in self.stats under the given endpoint.
+    def Send(self, method, url, params, obj, headers, endpoint):
+        for attempt in xrange(RATE_LIMIT_RETRIES + 1):
+            queuedAt = time.time()
+            self.scheduler.Acquire()
+            sentAt = time.time()
+            resp = None
+            try:
+                resp = self.session.request(method, url, params=params, json=obj,
+                                            headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                self.stats.Record(endpoint, time.time() - sentAt, e.__class__.__name__,
+                                  queued=sentAt - queuedAt)
+                raise
+            finally:
+                self.scheduler.Release(resp.headers if resp is not None else None)
+
+            self.stats.Record(endpoint, time.time() - sentAt, resp.status_code,
+                              queued=sentAt - queuedAt,
+                              headers=resp.elapsed.total_seconds(),
+                              sent=len(resp.request.body or ""),
+                              received=len(resp.content))
+
+            if resp.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                break
+
+            self.stats.Retry(endpoint)
+
+            now = time.time()
+            retryAt = S.ParseReset(resp.headers.get('Retry-After', ""), now)
+            if retryAt is None or retryAt <= now:
+                retryAt = now + S.RATE_WINDOW
+            self.scheduler.Pause(retryAt - now)
+
+        return resp
+
+    # Run a call that must not take effect twice (scores, creates). When it
+    # fails in a way that leaves unclear whether the server applied it,
+    # applied() looks for its effect on the server and returns the result
+    # to use if it finds it, or None, in which case the call is resent.
+    # This is the only retry layer of such calls: call() must send with
+    # retry=False. Retries are recorded in self.stats under the endpoint.
+    def CallOnce(self, call, endpoint, applied=None):
+        for attempt in xrange(MAX_RETRIES + 1):
+            try:
+                return call()
+            except (requests.exceptions.RequestException, APIError) as e:
+                if attempt == MAX_RETRIES or not IsTransient(e):
+                    raise
+
+                if NotProcessed(e):
+                    logger.warn("Request was not processed, retrying: %s" % str(e))
+                elif applied is None:
+                    raise
+                else:
+                    result = applied()
+                    if result is not None:
+                        logger.warn("Request failed but was applied: %s" % str(e))
+                        return result
+                    logger.warn("Request failed and was not applied, retrying: %s" % str(e))
+
+            self.stats.Retry(endpoint)
+            Backoff(attempt)
 
-        if(method == 'get'):
-            url+="?"
-            for param, value in params.iteritems():
-                url+=param + "=" + value
+    # General Wrapper to fetch JSON data from server
+    # With envelope=True the whole response body is returned instead of just
+    # its 'data' field (e.g. to read 'userV')
+    def APIV3_call(self,path,params={},failure='hard',method='get',obj=None,envelope=False,retry=True):
 
-        logger.warn("Calling V3 API: %s" % url)
-        resp = request_methods[method](url, headers=self.headers,json=obj)
+        resp = self.APIV3_request(path, params, method, obj, retry=retry)
 
         # Need some error handling here
+        decodeStart = time.time()
         if resp.status_code == 200:
             logger.debug("HTTP Response: 200 Okay!")
-            rval = resp.json()['data']
+            rval = resp.json()
         elif  resp.status_code == 201:
             logger.debug("HTTP Response: 201 Object Created")
-            rval = resp.json()['data']
+            rval = resp.json()
         else:
             if(failure=='hard'):
-                raise ValueError("HTTP Response not recognized: %d" % resp.status_code)
+                raise APIError(resp.status_code)
             else:
                 logger.warn("HTTP Response not recognized: %d" % resp.status_code)
-                rval = -1
+                return -1
+
+        self.stats.Decoded(MT.Endpoint(method, path), time.time() - decodeStart)
+
+        if not envelope:
+            rval = rval['data']
 
         return rval
 
@@ -86,10 +338,44 @@ class RequestManager(object):
     def FetchGameContent(self):
         return self.APIV3_call("content")
 
+    # Conditional version of FetchGameContent, used to revalidate a cached
+    # copy. Returns (content, validators), where content is None if the copy
+    # described by the given validators ({'etag': ..., 'modified': ...}) is
+    # still current
+    def FetchGameContentIfChanged(self, validators=None):
+        if validators is None:
+            validators = {}
+
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('modified'):
+            headers['If-Modified-Since'] = validators['modified']
+
+        resp = self.APIV3_request("content", headers=headers)
+        if resp.status_code == 304:
+            logger.debug("HTTP Response: 304 Not Modified")
+            return None, validators
+        elif resp.status_code != 200:
+            raise APIError(resp.status_code)
+
+        validators = {'etag': resp.headers.get('ETag'),
+                      'modified': resp.headers.get('Last-Modified')}
+        return resp.json()['data'], validators
+
     #Fetches the User Object from the API
     # https://habitica.com/apidoc/#api-User-UserGet
-    def FetchUserData(self):
-        return self.APIV3_call("user")
+    # 'fields' limits the response to the given paths of the user document
+    # (e.g. ['stats', 'items.gear.equipped']) instead of the whole of it
+    def FetchUserData(self, fields=None):
+        if fields is None:
+            return self.APIV3_call("user")
+        return self.APIV3_call("user", {'userFields': ",".join(fields)})
+
+    # Only the version of the user document, which the server bumps on every
+    # change to it
+    def FetchUserVersion(self):
+        return self.FetchUserData(['_v'])['_v']
 
     #Fetches User Tasks from the API.
     # https://habitica.com/apidoc/#api-Task-GetUserTasks
@@ -105,17 +391,66 @@ class RequestManager(object):
 
         return tasks
 
+    # Fetch a single task, None if it does not exist
+    # https://habitica.com/apidoc/#api-Task-GetTask
+    def FetchTask(self, task_id):
+        task = self.APIV3_call("tasks/"+task_id, failure='soft')
+        if task == -1:
+            return None
+        return task
+
     # Score a task up/down
     # https://habitica.com/apidoc/#api-Task-ScoreTask
-    def ScoreTask(self,task_id,direction):
+    # value is the value of the task before scoring, if known. It is used to
+    # tell whether a score whose response got lost went through.
+    def ScoreTask(self,task_id,direction,envelope=False,value=None):
         if(direction not in ['up','down']):
             raise ValueError("Unknown task direction %s" % direction)
-        return self.APIV3_call("tasks/"+task_id+"/score/"+direction,method='post')
 
-    # Add a new task
+        path = "tasks/"+task_id+"/score/"+direction
+
+        def Score():
+            return self.APIV3_call(path,method='post',envelope=True,retry=False)
+
+        def Applied():
+            # Only a value which this score explains counts: the value also
+            # moves with cron or scores from other clients. The stats of such
+            # a score are unknown, hence the empty 'data'; the task as
+            # fetched is passed along instead.
+            task = self.FetchTask(task_id)
+            if task is not None and SC.ScoredFrom(task, value, direction):
+                return {'data': None, 'task': task}
+            return None
+
+        resp = self.CallOnce(Score, MT.Endpoint('post', path),
+                             Applied if value is not None else None)
+        if not envelope:
+            resp = resp['data']
+        return resp
+
+    # Add a new task, or several at once if task_obj is a list
     # https://habitica.com/apidoc/#api-Task-CreateUserTasks
+    # Tasks are given client-side IDs, so that a create whose response got
+    # lost can be looked up instead of creating duplicates.
     def CreateTask(self, task_obj):
-        return self.APIV3_call("tasks/user",method='post',obj=task_obj)
+        task_objs = task_obj if isinstance(task_obj, list) else [task_obj]
+        for i in task_objs:
+            i.setdefault('id', str(uuid.uuid4()))
+
+        def Create():
+            return self.APIV3_call("tasks/user",method='post',obj=task_obj,retry=False)
+
+        def Applied():
+            found = [self.FetchTask(i['id']) for i in task_objs]
+            if None not in found:
+                return found if isinstance(task_obj, list) else found[0]
+            if found.count(None) != len(found):
+                # Partly created, resending would duplicate some of them
+                raise ValueError("Only %d of %d tasks were created" %
+                                 (len(found) - found.count(None), len(found)))
+            return None
+
+        return self.CallOnce(Create, MT.Endpoint('post', "tasks/user"), Applied)
 
     # Delete a task
     # https://habitica.com/apidoc/#api-Task-DeleteTask
@@ -132,6 +467,38 @@ class RequestManager(object):
     def FetchParty(self):
         return self.APIV3_call("groups/party")
 
+    # Only the chat of the party, newest message first. There is no way to
+    # ask for the messages after a given one, the whole chat is returned.
+    # https://habitica.com/apidoc/#api-Chat-GetChat
+    def FetchPartyChat(self):
+        return self.APIV3_call("groups/party/chat")
+
+    ################################
+    ## Asynchronous API Calls      #
+    ################################
+
+    # The same calls, run on the transport threads (one per pooled
+    # connection). They return a W.Future right away, which the UI can poll
+    # (Done), wait for (Interface.Await) or attach a callback to
+    # (Interface.dispatcher.OnDone).
+    def FetchUserDataAsync(self, fields=None):
+        return self.transport.Submit(self.FetchUserData, fields)
+
+    def FetchUserTasksAsync(self, task_type=None):
+        return self.transport.Submit(self.FetchUserTasks, task_type)
+
+    def FetchPartyAsync(self):
+        return self.transport.Submit(self.FetchParty)
+
+    def FetchPartyChatAsync(self):
+        return self.transport.Submit(self.FetchPartyChat)
+
+    def ScoreTaskAsync(self, task_id, direction, envelope=False, value=None):
+        return self.transport.Submit(self.ScoreTask, task_id, direction, envelope, value)
+
+    def UpdateTaskAsync(self, task_id, task_obj):
+        return self.transport.Submit(self.UpdateTask, task_id, task_obj)
+
 
 
     ################################
@@ -143,21 +510,7 @@ class RequestManager(object):
     # request based
 
     def CreateTask_orig(self,title,task_type):
-        task = {}
-        task['text'] = title.decode("utf-8")
-        task['type'] = task_type
-        task['priority'] = 1
-
-        if task_type == 'todo' or task_type == 'daily':
-            task['checklist'] = []
-        if task_type == "daily":
-            task['everyX'] = 1
-            task['frequency'] = 'weekly'
-            task['repeat'] = {'m': True, 't': True, 'w': True, 'th': True, 'f': True, 's': True, 'su': True}
-        if task_type == "habit":
-            task['up'] = True
-            task['down'] = True
-
+        task = IM.TaskObject(title, task_type)
 
         DEBUG.Display("Creating Task...");
         ret_task = self.CreateTask(task)
@@ -180,14 +533,78 @@ class RequestManager(object):
             menu_item = M.MenuItem(item, "todo", item.text)
             G.TODOMenu.Insert(menu_item)
 
+    # Create many tasks (see importer.ReadTaskFile) in batched requests sent
+    # concurrently, and add them to the top of the menus without redrawing.
+    # Returns the number of tasks created and the number that failed.
+    def ImportTasks(self, task_objs):
+        batches = [task_objs[i:i+IMPORT_BATCH_SIZE]
+                   for i in xrange(0, len(task_objs), IMPORT_BATCH_SIZE)]
+        futures = [self.workers.Submit(self.CreateTask, batch) for batch in batches]
+        W.WaitAll(futures)
+
+        newItems = {'habit': [], 'daily': [], 'todo': []}
+        created, failed = 0, 0
+        for (batch, future) in zip(batches, futures):
+            if future.Failed():
+                logger.warn("Could not create %d tasks: %s" % (len(batch), str(future.error)))
+                failed += len(batch)
+                continue
+
+            ret_tasks = future.result
+            if isinstance(ret_tasks, dict):
+                ret_tasks = [ret_tasks]
+
+            for i in ret_tasks:
+                menu_item = self.NewMenuItem(i)
+                if menu_item is not None:
+                    newItems[menu_item.task_type] += [menu_item]
+                created += 1
+
+        G.HabitMenu.Replace(newItems['habit'] + G.HabitMenu.items)
+        G.DailyMenu.Replace(newItems['daily'] + G.DailyMenu.items)
+        G.TODOMenu.Replace(newItems['todo'] + G.TODOMenu.items)
+
+        return created, failed
+
     # Flush Queues (this doesn't belong as part of the reuqest manager!)
+    # Menu items with queued changes
+    def QueuedItems(self):
+        return (self.MarkUpQueue + self.MarkDownQueue + self.MarkQueue +
+                self.DeleteQueue + self.EditQueue)
+
     def ClearQueues(self):
 
+        # Rows of dropped changes are not pending any more; the ones which
+        # are sent are marked again (see SendAsync)
+        if hasattr(self, 'EditQueue'):
+            for i in self.QueuedItems():
+                i.sync = None
+
         self.MarkUpQueue = []
         self.MarkDownQueue = []
         self.MarkQueue = []
         self.DeleteQueue = []
         self.EditQueue = []
+        self.flushAfterRevalidation = False
+
+    # Start fetching the user, the tasks and the game content in parallel.
+    # Called as soon as the config has been read, so that the requests are
+    # in flight while curses is being initialized.
+    def Prefetch(self):
+        import content as CT
+
+        self.userFuture = self.FetchUserDataAsync(U.USER_FIELDS)
+        self.tasksFuture = self.FetchUserTasksAsync()
+        self.contentFuture = W.Spawn(CT.LoadContent)
+
+    # Future for the content manager, reusing the prefetched one if any
+    def GameContent(self):
+        import content as CT
+
+        future, self.contentFuture = self.contentFuture, None
+        if future is None:
+            future = W.Spawn(CT.LoadContent)
+        return future
 
     #Fetches basic user data for the interface
     def FetchData(self):
@@ -195,20 +612,214 @@ class RequestManager(object):
 
         G.LastUpdate = datetime.datetime.now()
 
+        # Use the startup fetches if they are still pending
+        userFuture, self.userFuture = self.userFuture, None
+        tasksFuture, self.tasksFuture = self.tasksFuture, None
+        if userFuture is None:
+            userFuture = self.FetchUserDataAsync(U.USER_FIELDS)
+        if tasksFuture is None:
+            tasksFuture = self.FetchUserTasksAsync()
+
+        # Show the data of the last session right away, the fetches then
+        # only revalidate it
+        snapshot = SN.ReadSnapshot()
+        if snapshot is not None:
+            logger.debug("Starting from the snapshot of %s" % time.ctime(snapshot['saved']))
+            G.LastUpdate = datetime.datetime.fromtimestamp(snapshot['saved'])
+            G.stale = True
+            self.revalidation = (userFuture, tasksFuture)
+            self.BuildMenus(snapshot['tasks'])
+            G.user = U.User(snapshot['user'])
+            return
+
         #Get the user data from the API
         DEBUG.Display("Connecting...")
 
-        user_json = self.FetchUserData()
-        task_json = self.FetchUserTasks()
+        # The menus only need the tasks, build them while the user data is
+        # still on its way
+        task_json = tasksFuture.Result()
+        self.BuildMenus(task_json)
 
-        DEBUG.Display("Connected")
-        time.sleep(1)
+        user_json = userFuture.Result()
         DEBUG.Display(" ")
-
+        self.userVersion = user_json.get('_v', None)
+        self.SaveSnapshot(task_json, user_json)
 
         # Initialize User Stats
         G.user = U.User( user_json )
 
+    # Wait in the background for the fetches started by FetchData when the
+    # data was shown from the snapshot (or fetch it again); callback(tasks,
+    # user) is then called on a worker thread, like for StartAutoRefresh.
+    # While the snapshot is shown, failed attempts are retried every
+    # REVALIDATE_RETRY_DELAY seconds.
+    def Revalidate(self, callback):
+        if self.revalidation is None:
+            self.revalidation = (self.FetchUserDataAsync(U.USER_FIELDS),
+                                 self.FetchUserTasksAsync())
+
+        userFuture, tasksFuture = self.revalidation
+        self.revalidation = None
+        W.Spawn(self.AwaitRevalidation, userFuture, tasksFuture, callback)
+
+    def AwaitRevalidation(self, userFuture, tasksFuture, callback):
+        try:
+            task_json = tasksFuture.Result()
+            user_json = userFuture.Result()
+        except (requests.exceptions.RequestException, APIError) as e:
+            logger.warn("Could not revalidate the data: %s" % str(e))
+            if not G.stale:
+                return
+
+            # The snapshot stays on screen until a later attempt succeeds
+            G.intf.dispatcher.Post(DEBUG.Display, "Could not reach the server, showing cached data (retrying in %ds)" %
+                                   REVALIDATE_RETRY_DELAY)
+            time.sleep(REVALIDATE_RETRY_DELAY)
+
+            # Unless a reload got there first
+            if G.stale:
+                self.Revalidate(callback)
+            return
+
+        self.userVersion = user_json.get('_v', None)
+        callback(task_json, user_json)
+
+    # Persist freshly fetched data, without holding up the caller
+    def SaveSnapshot(self, task_json, user_json):
+        W.Spawn(SN.WriteSnapshot, task_json, user_json)
+
+    # Persist the current model (on exit)
+    def SaveModelSnapshot(self):
+        if G.user is None or G.stale:
+            return
+
+        tasks = []
+        for menu in [G.HabitMenu, G.DailyMenu, G.TODOMenu]:
+            tasks += [i.task.ToJSON() for i in menu.items]
+        SN.WriteSnapshot(tasks, G.user.data)
+
+    # Task object for a fetched task, None if the task is not displayed
+    def NewTask(self, i):
+        logger.debug("Processing a TODO: %s" % i['text'].encode("utf-8").strip())
+        if( i['type'] == "habit" ):
+            return T.Habit(i)
+        elif( i['type'] == "daily" ):
+            return T.Daily(i)
+        elif( i['type'] == "todo" ):
+            if i['completed']:
+                return None
+            return T.TODO(i)
+        elif( i['type'] == "reward" ):
+            logger.warn("Custom Rewards aren't implemented yet, but the user has one: %s" % i['text'])
+            return None
+        else:
+            logger.debug("Weird task %s with type: %s" %(i['text'].encode("utf-8"), i['type'].encode("utf-8")))
+            raise ValueError("Unknown task type %s" % i['type'].encode("utf-8"))
+
+    def NewMenuItem(self, i):
+        item = self.NewTask(i)
+        if item is None:
+            return None
+        return M.MenuItem(item, item.task_type, item.text)
+
+    # Refresh the existing model from the server. Only tasks which were
+    # added, removed or changed (by 'updatedAt') since the last fetch are
+    # rebuilt; scroll positions and selections are kept.
+    def ReloadData(self):
+
+        G.LastUpdate = datetime.datetime.now()
+
+        DEBUG.Display("Connecting...")
+        userFuture = self.FetchUserDataAsync(U.USER_FIELDS)
+        tasksFuture = self.FetchUserTasksAsync()
+
+        task_json = tasksFuture.Result()
+        self.ApplyTaskDelta(task_json)
+        user_json = userFuture.Result()
+        G.user.Reload(user_json)
+        self.userVersion = user_json.get('_v', None)
+        self.SaveSnapshot(task_json, user_json)
+        G.stale = False
+        DEBUG.Display(" ")
+
+    # Poll for changes made elsewhere (web, mobile) every "refresh_interval"
+    # seconds. The tasks and the user are only fetched when the version of
+    # the user document moved; callback(tasks, user) is then called on the
+    # refresher thread.
+    def StartAutoRefresh(self, callback):
+        interval = C.getConfigInt("refresh_interval", REFRESH_INTERVAL)
+        if interval <= 0:
+            return
+
+        thread = threading.Thread(target=self.AutoRefresh, args=(interval, callback))
+        thread.daemon = True
+        thread.start()
+
+    def AutoRefresh(self, interval, callback):
+        while(1):
+            time.sleep(interval)
+            try:
+                version = self.FetchUserVersion()
+                if version == self.userVersion:
+                    continue
+
+                logger.debug("User changed (version %s -> %s), refreshing" %
+                             (str(self.userVersion), str(version)))
+                tasksFuture = self.FetchUserTasksAsync()
+                user_json = self.FetchUserData(U.USER_FIELDS)
+                task_json = tasksFuture.Result()
+            except (requests.exceptions.RequestException, APIError) as e:
+                logger.warn("Background refresh failed: %s" % str(e))
+                continue
+
+            self.userVersion = user_json.get('_v', version)
+            callback(task_json, user_json)
+
+    def ApplyTaskDelta(self, task_json):
+        menus = {'habit': G.HabitMenu, 'daily': G.DailyMenu, 'todo': G.TODOMenu}
+        existing = {}
+        for menu in menus.values():
+            for i in menu.items:
+                existing[i.task.taskID] = i
+
+        # New item lists in server order, reusing the existing menu items
+        newItems = {'habit': [], 'daily': [], 'todo': []}
+        added, updated, kept = 0, 0, 0
+        for i in task_json:
+            old = existing.get(i['id'], None)
+            if (old is not None and old.task_type == i['type'] and
+                    old.task.updatedAt == i.get('updatedAt')):
+                newItems[old.task_type] += [old]
+                kept += 1
+                continue
+
+            item = self.NewTask(i)
+            if item is None:
+                continue
+
+            if old is not None and old.task_type == item.task_type:
+                # Changed on the server, swap the task under the menu item.
+                # Marks made meanwhile (on the snapshot) are kept.
+                marks = old.status.attributes
+                old.SetTask(item)
+                for key in marks:
+                    if key in old.status.attributes:
+                        old.status.attributes[key] = marks[key]
+                newItems[item.task_type] += [old]
+                updated += 1
+            else:
+                newItems[item.task_type] += [M.MenuItem(item, item.task_type, item.text)]
+                added += 1
+
+        for task_type, menu in menus.items():
+            menu.Replace(newItems[task_type])
+
+        logger.debug("Reload: %d added, %d changed, %d removed" %
+                     (added, updated, len(existing) - kept - updated))
+
+    # Build the Habit, Daily and TODO menus from the fetched tasks
+    def BuildMenus(self, task_json):
+
         # These will contain the menu items passed to create the Habit, Daily
         # and Todo menus
         habit_items   = []
@@ -218,23 +829,16 @@ class RequestManager(object):
         logger.debug("Found %d tasks" % len(task_json))
 
         for i in task_json:
-            logger.debug("Processing a TODO: %s" % i['text'].encode("utf-8").strip())
-            if( i['type'] == "habit" ):
-                item = T.Habit(i)
-                habit_items += [M.MenuItem(item, "habit", item.text)]
-            elif( i['type'] == "daily" ):
-                item = T.Daily(i)
-                dailies_items += [M.MenuItem(item, "daily", item.text)]
-            elif( i['type'] == "todo" ):
-                if i['completed']:
-                    continue
-                item = T.TODO(i)
-                todos_items += [M.MenuItem(item, "todo", item.text)]
-            elif( i['type'] == "reward" ):
-                logger.warn("Custom Rewards aren't implemented yet, but the user has one: %s" % i['text'])
-            else:
-                logger.debug("Weird task %s with type: %s" %(i['text'].encode("utf-8"), i['type'].encode("utf-8")))
-                raise ValueError("Unknown task type %s" % i['type'].encode("utf-8"))
+            menu_item = self.NewMenuItem(i)
+            if menu_item is None:
+                continue
+
+            if menu_item.task_type == "habit":
+                habit_items += [menu_item]
+            elif menu_item.task_type == "daily":
+                dailies_items += [menu_item]
+            elif menu_item.task_type == "todo":
+                todos_items += [menu_item]
 
         # Generate the menus for the display
         G.HabitMenu = M.Menu(habit_items, "Habits")
@@ -242,98 +846,374 @@ class RequestManager(object):
         G.TODOMenu  = M.Menu(todos_items, "TODOs")
 
 
-    # Write back changes to the server and update the interface
-    def Flush(self,flush_for_quit=False):
-
-        #TODO: most of this should not happen in the request manager
-        import content as CT
-
-        DEBUG.Display("Please Wait...")
-
-        Drops = list()
+    # Turn the queues into a list of operations, in the order in which the
+    # queues used to be sent. Each operation is a dict with:
+    #   kind      - 'up'/'down' (habits), 'mark' (dailies/TODOs), 'delete' or 'update'
+    #   task      - ID of the task
+    #   direction - score direction (score operations only)
+    #   value     - task value before scoring (score operations only)
+    #   body      - task JSON (updates only)
+    #   item      - the queued menu item
+    def QueuedOperations(self):
+        ops = []
 
-        # Difference obtained in user stats due to these operations
-        origDict = {'hp': G.user.hp, 'gp': G.user.gp, 'mp': G.user.mp,
-                    'exp': G.user.exp, 'lvl': G.user.lvl}
-        diffDict = origDict.copy()
-
-        #
-        #
-        #
-        # Habits marked as +
         for i in self.MarkUpQueue:
-            logger.debug("Marking '%s' up" % str(i.taskname))
-            json = self.ScoreTask(i.task.taskID,'up')
+            ops.append({'kind': 'up', 'task': i.task.taskID, 'direction': 'up',
+                        'value': i.task.value, 'item': i})
 
-            for i in diffDict:
-                diffDict[i] = json[i]
-
-            # Check for drops
-            tmpdrp = CT.CheckDrops( json['_tmp'] )
-            if( tmpdrp is not None):
-                Drops.append(tmpdrp)
-
-        #
-        #
-        #
-        # Habits marked as -
         for i in self.MarkDownQueue:
-            logger.debug("Marking '%s' down" % str(i))
-            json = self.ScoreTask(i.task.taskID,'down')
+            ops.append({'kind': 'down', 'task': i.task.taskID, 'direction': 'down',
+                        'value': i.task.value, 'item': i})
 
-            for i in diffDict:
-                diffDict[i] = json[i]
-
-        #
-        #
-        #
-        # Dailies and TODOS marked as completed
         for i in self.MarkQueue:
-            direction = None
             if i.task.task_type != "daily" or (not i.task.completed):
                 direction = "up"
             else:
                 direction = "down"
+            ops.append({'kind': 'mark', 'task': i.task.taskID, 'direction': direction,
+                        'value': i.task.value, 'item': i})
 
-            if (direction is None):
-                continue
+        for i in self.DeleteQueue:
+            ops.append({'kind': 'delete', 'task': i.task.taskID, 'item': i})
 
-            json = self.ScoreTask(i.task.taskID,direction)
+        for i in self.EditQueue:
+            ops.append({'kind': 'update', 'task': i.task.taskID, 'body': i.task.ToJSON(), 'item': i})
+
+        return ops
+
+    # Normalise the pending operations of each task before anything is sent:
+    #   - nothing is sent for a task after its delete, and edits before the
+    #     delete are dropped
+    #   - successive edits collapse into the last one, whose body is the
+    #     latest state of the task
+    #   - a daily/TODO checked twice is checked once, and checked then
+    #     unchecked (or the reverse) is not sent at all
+    # Score order and habit '+'/'-' presses are kept as they are. Dropped
+    # operations which are already in the journal are acknowledged there.
+    def CompactOperations(self, ops):
+        chains = OrderedDict()
+        for op in ops:
+            chains.setdefault(op['task'], []).append(op)
+
+        kept = set()
+        for chain in chains.values():
+            result = []
+            for op in chain:
+                if result and result[-1]['kind'] == 'delete':
+                    continue
+                if op['kind'] in ['delete', 'update']:
+                    result = [i for i in result if i['kind'] != 'update']
+                elif op['kind'] == 'mark' and result and result[-1]['kind'] == 'mark':
+                    if result[-1]['direction'] != op['direction']:
+                        result.pop()
+                    continue
+                result.append(op)
 
-            if i.task.task_type == "todo":
-                G.TODOMenu.Remove(i.task.taskID)
-            elif i.task.task_type == "daily":
-                i.task.completed ^= True
+            kept.update([id(i) for i in result])
 
-            for i in diffDict:
-                diffDict[i] = json[i]
+        compacted = [op for op in ops if id(op) in kept]
+        for op in ops:
+            if id(op) not in kept and 'journal' in op:
+                self.journal.Ack(op)
 
-            # Check for drops
-            tmpdrp = CT.CheckDrops( json['_tmp'] )
-            if( tmpdrp is not None):
-                Drops.append(tmpdrp)
+        if len(compacted) < len(ops):
+            logger.debug("Compacted %d operations into %d" % (len(ops), len(compacted)))
+        return compacted
 
-        #
-        #
-        #
-        for i in self.DeleteQueue:
-            self.DeleteTask(i.task.taskID)
+    # Scores the user has marked or queued but not written yet, as
+    # (menu item, direction) pairs in the order they will be sent
+    def PendingScores(self):
+        scores = []
+        for i in self.MarkUpQueue:
+            scores.append((i, 'up'))
+        for i in self.MarkDownQueue:
+            scores.append((i, 'down'))
+        for i in self.MarkQueue:
+            scores.append((i, 'down' if i.task.task_type == "daily" and i.task.completed else 'up'))
+
+        for menu in [G.HabitMenu, G.DailyMenu, G.TODOMenu]:
+            for i in menu.items:
+                scores += [(i, 'up')]*i.status.attributes.get("+", 0)
+                scores += [(i, 'down')]*i.status.attributes.get("-", 0)
+                if i.status.attributes.get(C.SYMBOL_TICK, False):
+                    scores.append((i, 'down' if i.task.task_type == "daily" and i.task.completed else 'up'))
+
+        return scores
+
+    # Predicted stats of the user once the pending scores are written, or
+    # None if the user's attributes are not known yet (content not loaded)
+    def PredictPending(self):
+        if not G.user.attrStats:
+            return None
+
+        scores = [(SC.TaskState(i.task), direction) for (i, direction) in self.PendingScores()]
+        return SC.Predict(G.user.StatsDict(), G.user.attrStats, scores)[0]
+
+    # Predict the outcome of the score operations of a flush. Each of them
+    # gets its 'predicted' value delta; the predicted stats are returned
+    # (None if they cannot be predicted).
+    def PredictOperations(self, ops):
+        if not G.user.attrStats:
+            return None
+
+        scoreOps = [op for op in ops if op['kind'] in ['up', 'down', 'mark'] and 'item' in op]
+        if not scoreOps:
+            return None
+
+        scores = [(SC.TaskState(op['item'].task, op.get('value')), op['direction']) for op in scoreOps]
+        stats, deltas = SC.Predict(G.user.StatsDict(), G.user.attrStats, scores)
+        for (op, delta) in zip(scoreOps, deltas):
+            op['predicted'] = delta
+        return stats
+
+    def SendOperation(self, op):
+        if op['kind'] in ['up', 'down', 'mark']:
+            return self.ScoreTask(op['task'], op['direction'], envelope=True,
+                                  value=op.get('value'))
+        elif op['kind'] == 'delete':
+            return self.DeleteTask(op['task'])
+        elif op['kind'] == 'update':
+            return self.UpdateTask(op['task'], op['body'])
+
+        raise ValueError("Unknown operation %s" % op['kind'])
+
+    # Operations in the journal that the server never acknowledged, with the
+    # menu item of their task attached when it is still displayed
+    def JournalOperations(self):
+        ops = self.journal.Pending()
+        for op in ops:
+            for menu in [G.HabitMenu, G.DailyMenu, G.TODOMenu]:
+                if menu is not None and menu.Find(op['task']) is not None:
+                    op['item'] = menu.Find(op['task'])
+                    break
+
+        return ops
+
+    # Resend the unacknowledged operations of an earlier session, in the
+    # background like a write-behind flush (see FlushAsync). Called once the
+    # interface is up, so that startup does not wait for them. The data was
+    # fetched meanwhile and may or may not include them: it is fetched again
+    # once they are written.
+    def ReplayJournal(self):
+        ops = self.TakeOperations()
+        if not ops:
+            self.journal.Compact()
+            return
+
+        logger.warn("Replaying %d unacknowledged operations" % len(ops))
+        self.refreshAfterWrites = True
+        self.SendAsync(ops, "Resending %d changes from the last session..." % len(ops))
+
+    # Send the operations over the worker pool. Operations on the same task
+    # form a chain which is sent serially (several '+' on a habit stay in
+    # order), while different tasks are sent concurrently. Each operation
+    # gets a 'response' (and its arrival number 'seq') or an 'error'; the
+    # rest of a chain is skipped once one of its operations fails, with a
+    # Skipped error (they stay in the journal). onResult(op), if given, is
+    # called on the worker thread as soon as an operation is done or skipped.
+    def SendOperations(self, ops, onResult=None):
+        chains = OrderedDict()
+        for op in ops:
+            chains.setdefault(op['task'], []).append(op)
+
+        arrivals = itertools.count()
+        arrivalLock = threading.Lock()
+
+        def SendChain(chain):
+            scored = False  # Whether an earlier score of the task went through
+            value = None    # Value of the task after that score, if known
+            for (n, op) in enumerate(chain):
+                isScore = op['kind'] in ['up', 'down', 'mark']
+                if isScore and scored:
+                    if value is None:
+                        op.pop('value', None)
+                    else:
+                        op['value'] = value
+
+                try:
+                    response = self.SendOperation(op)
+                except Exception as e:
+                    logger.warn("Operation %s on %s failed: %s" % (op['kind'], op['task'], str(e)))
+                    op['error'] = e
+                    if isinstance(e, APIError) and e.IsPermanent():
+                        # Retrying would fail again, drop it from the journal
+                        self.journal.Ack(op)
+                    if onResult is not None:
+                        onResult(op)
+
+                    # Later operations depend on this one
+                    for skipped in chain[n+1:]:
+                        skipped['error'] = Skipped(op)
+                        if onResult is not None:
+                            onResult(skipped)
+                    return
+
+                self.journal.Ack(op)
+                if isScore:
+                    scored = True
+                    if op.get('value') is not None and response['data'] is not None:
+                        value = op['value'] + response['data']['delta']
+                    elif response.get('task') is not None:
+                        value = response['task']['value']
+                    else:
+                        value = None
+
+                with arrivalLock:
+                    op['response'] = response
+                    op['seq'] = next(arrivals)
+
+                if onResult is not None:
+                    onResult(op)
+
+        W.WaitAll([self.workers.Submit(SendChain, chain) for chain in chains.values()])
+
+    # Of two score responses, the one reflecting the later state of the user.
+    # Habitica stamps responses with the user document version; fall back to
+    # the order of arrival if it is missing
+    def LatestScore(self, op1, op2):
+        if op1 is None:
+            return op2
+
+        key1 = (op1['response'].get('userV', -1), op1['seq'])
+        key2 = (op2['response'].get('userV', -1), op2['seq'])
+        if key2 > key1:
+            return op2
+        return op1
+
+    # Take the queued operations for sending: compacted together with the
+    # ones left in the journal, and persisted before anything is sent
+    def TakeOperations(self):
+        queued = self.QueuedItems()
+        ops = self.CompactOperations(self.JournalOperations() + self.QueuedOperations())
+        self.journal.Append([op for op in ops if 'journal' not in op])
+        self.ClearQueues()
 
+        # Changes which cancelled out (e.g. checked then unchecked)
+        sent = set([id(op['item']) for op in ops if 'item' in op])
+        for i in queued:
+            if id(i) not in sent:
+                G.intf.RedrawItem(i)
+        return ops
+
+    # Apply the outcome of a sent operation to the menus. 'batch' collects
+    # the drops and the latest score of a flush. Returns True if a task was
+    # removed or completed, i.e. the menus need to be redrawn.
+    def ApplyResult(self, op, batch):
+        import content as CT
+
+        if 'response' not in op or 'item' not in op:
+            return False
+
+        i = op['item']
+        if op['kind'] in ['up', 'down', 'mark']:
+            # Keep the task in step with the server: later scores of the task
+            # are predicted and journaled from its value and streak
+            data = op['response']['data']
+            if data is not None:
+                i.task.SetValue(i.task.value + data['delta'])
+                if i.task.task_type == "daily":
+                    if op['direction'] == "up":
+                        i.task.streak += 1
+                    else:
+                        i.task.streak = max(i.task.streak - 1, 0)
+            elif op['response'].get('task') is not None:
+                task = op['response']['task']
+                i.task.SetValue(task['value'])
+                if i.task.task_type == "daily":
+                    i.task.streak = task.get('streak', 0)
+
+            # The stats are unknown if only the retry logic found out that
+            # the score went through
+            if op['response']['data'] is not None:
+                batch['latestScore'] = self.LatestScore(batch['latestScore'], op)
+
+            # Check for drops
+            if op['kind'] != 'down' and op['response']['data'] is not None:
+                tmpdrp = CT.CheckDrops( op['response']['data']['_tmp'] )
+                if( tmpdrp is not None):
+                    batch['drops'].append(tmpdrp)
+
+            if op['kind'] == 'mark':
+                if i.task.task_type == "todo":
+                    G.TODOMenu.Remove(i.task.taskID)
+                elif i.task.task_type == "daily":
+                    # Set rather than toggled, a refresh may already have
+                    # brought in the server's state
+                    i.task.completed = (op['direction'] == 'up')
+                return True
+
+        elif op['kind'] == 'delete':
             if i.task.task_type == "habit":
                 G.HabitMenu.Remove(i.task.taskID)
             elif i.task.task_type == "daily":
                 G.DailyMenu.Remove(i.task.taskID)
             elif i.task.task_type == "todo":
                 G.TODOMenu.Remove(i.task.taskID)
+            return True
 
-        #
-        #
-        #
-        for i in self.EditQueue:
-            self.UpdateTask(i.task.taskID, i.task.data)
+        return False
+
+    # Show the drops found while flushing and how many operations failed
+    def FinishFlush(self, ops, batch):
+        if batch['drops']:
+            G.screen.SaveInRegister(1)
+            drop_items = []
+            for i in batch['drops']:
+                DEBUG.Display("Processing Drop %s..." % i);
+                drop_items += [M.SimpleTextItem(i)]
+
+            dropMenu = M.SimpleTextMenu(drop_items, C.SCR_TEXT_AREA_LENGTH)
+            dropMenu.SetXY(C.SCR_FIRST_HALF_LENGTH, 5)
+            dropMenu.Display()
+            dropMenu.Input()
+            G.screen.RestoreRegister(1)
+
+        # Failed operations stay in the journal for the next flush/launch
+        failed = len([op for op in ops if 'error' in op])
+        if failed:
+            DEBUG.Display("%d changes could not be sent, they will be retried on the next write" % failed)
+
+    # Write back changes to the server and update the interface. Returns
+    # False if nothing was written because the data shown from the snapshot
+    # could not be revalidated; the changes then stay queued.
+    def Flush(self,flush_for_quit=False):
+
+        DEBUG.Display("Please Wait...")
+
+        # Operations of a write-behind flush must not be sent twice
+        self.WaitForFlush()
+
+        # Scores must not be based on the snapshot (see FlushAsync)
+        if G.stale:
+            try:
+                self.ReloadData()
+            except (requests.exceptions.RequestException, APIError) as e:
+                logger.warn("Could not revalidate the data before writing: %s" % str(e))
+                DEBUG.Display("Could not update the cached data, nothing was written")
+                return False
+
+        # Difference obtained in user stats due to these operations
+        diffDict = {'hp': G.user.hp, 'gp': G.user.gp, 'mp': G.user.mp,
+                    'exp': G.user.exp, 'lvl': G.user.lvl}
+
+        ops = self.TakeOperations()
+        self.SendOperations(ops)
+        self.journal.Compact()
+
+        # Apply the results in queue order
+        batch = {'drops': [], 'latestScore': None}
+        for op in ops:
+            self.ApplyResult(op, batch)
+            if 'item' in op:
+                op['item'].sync = 'failed' if 'error' in op else None
+
+        # Stats after the last score processed by the server
+        if batch['latestScore'] is not None:
+            for i in diffDict:
+                diffDict[i] = batch['latestScore']['response']['data'][i]
 
         if(flush_for_quit):
-            return
+            return True
 
         #
         #
@@ -343,23 +1223,151 @@ class RequestManager(object):
         G.intf.Init()
         G.user.PrintUserStats()
 
-        #
-        #
-        #
-        # Display Drop Messages
-        if Drops:
-            G.screen.SaveInRegister(1)
-            drop_items = []
-            for i in Drops:
-                DEBUG.Display("Processing Drop %s..." % i);
-                drop_items += [M.SimpleTextItem(i)]
+        self.FinishFlush(ops, batch)
+        return True
 
-            dropMenu = M.SimpleTextMenu(drop_items, C.SCR_TEXT_AREA_LENGTH)
-            dropMenu.SetXY(C.SCR_FIRST_HALF_LENGTH, 5)
-            dropMenu.Display()
-            dropMenu.Input()
-            G.screen.RestoreRegister(1)
+    ################################
+    ## Write-behind Flush          #
+    ################################
 
-        self.ClearQueues()
+    # A write-behind flush lasts until its results are applied on the UI
+    # thread (see FinishAsyncFlush), not only until the last response
+    def Flushing(self):
+        return self.flushFuture is not None
+
+    def WaitForFlush(self):
+        if self.flushFuture is not None:
+            self.flushFuture.Wait()
+
+    # Send the queued changes in the background and return right away. The
+    # rows of the tasks show whether their changes are pending, sent or
+    # failed, and the results are applied (and the stats bar updated) on
+    # the UI thread as each response arrives. A write requested while
+    # another one is draining follows once it is done. While the data shown
+    # is from the snapshot, the write waits for the revalidation: the
+    # direction and value of a score must come from the current task (a
+    # daily checked in the snapshot may have been reset by cron).
+    def FlushAsync(self):
+        queued = self.QueuedItems()
+        for i in queued:
+            i.sync = 'pending'
+            G.intf.RedrawItem(i)
+
+        if G.stale:
+            if queued:
+                self.flushAfterRevalidation = True
+                DEBUG.Display("Changes will be written once the cached data is updated")
+            return
+
+        if self.Flushing():
+            self.flushAgain = True
+            DEBUG.Display("Changes will be written once the previous write is done")
+            return
+
+        ops = self.TakeOperations()
+        if not ops:
+            return
+
+        self.SendAsync(ops, "Writing %d changes..." % len(ops))
+
+    # Send the taken operations in the background, showing the message
+    def SendAsync(self, ops, message):
+        for op in ops:
+            if 'item' in op:
+                op['item'].sync = 'pending'
+                G.intf.RedrawItem(op['item'])
+
+        batch = {'drops': [], 'latestScore': None, 'mismatches': 0}
+
+        # Show the predicted stats right away; the server's stats replace
+        # them once every response is in
+        batch['orig'] = G.user.StatsDict()
+        batch['predicted'] = self.PredictOperations(ops)
+        if batch['predicted'] is not None:
+            G.user.PrintDiff(batch['predicted'])
+            G.user.PrintData()
+            if G.user.attrStats:
+                G.user.PrintUserStats()
+
+        dispatcher = G.intf.dispatcher
+
+        def OnResult(op):
+            dispatcher.Post(self.ApplyAsyncResult, op, batch)
+
+        self.flushAgain = False
+        self.flushFuture = W.Spawn(self.SendOperations, ops, OnResult)
+        dispatcher.OnDone(self.flushFuture, lambda future: self.FinishAsyncFlush(ops, batch))
+        DEBUG.Display(message)
+
+    def ApplyAsyncResult(self, op, batch):
+        if 'item' not in op:
+            return
+
+        op['item'].sync = 'failed' if 'error' in op else 'sent'
+
+        # Compare the task value change with the prediction
+        if 'predicted' in op and 'response' in op and op['response']['data'] is not None:
+            actual = {'delta': op['response']['data']['delta']}
+            if SC.Mismatches({'delta': op['predicted']}, actual):
+                logger.warn("Score of %s: predicted delta %f, server %f" %
+                            (op['task'], op['predicted'], actual['delta']))
+                batch['mismatches'] += 1
+
+        latestScore = batch['latestScore']
+        if self.ApplyResult(op, batch):
+            G.intf.Redraw()
+        else:
+            G.intf.RedrawItem(op['item'])
+
+        # Without a prediction, follow the server's stats as they arrive
+        if batch['latestScore'] is not latestScore and batch['predicted'] is None:
+            G.user.PrintDiff(batch['latestScore']['response']['data'])
+            G.user.PrintData()
+            if G.user.attrStats:
+                G.user.PrintUserStats()
+
+    def FinishAsyncFlush(self, ops, batch):
+        self.flushFuture = None
+        self.journal.Compact()
+
+        # Only failures stay flagged
+        for op in ops:
+            if 'item' in op and op['item'].sync == 'sent':
+                op['item'].sync = None
+
+        # Replace the predicted stats with the server's last result, or with
+        # the stats from before the flush if no score went through
+        failed = [op for op in ops if 'error' in op]
+        mismatches = {}
+        if batch['predicted'] is not None:
+            if batch['latestScore'] is not None:
+                actual = batch['latestScore']['response']['data']
+            else:
+                actual = batch['orig']
+
+            # The prediction assumed every score would go through
+            if batch['latestScore'] is not None and not failed:
+                mismatches = SC.Mismatches(batch['predicted'], actual)
+                if mismatches:
+                    logger.warn("Predicted stats %s, server %s" % (str(batch['predicted']), str(actual)))
+
+            G.user.SetStats(batch['orig'])
+            G.intf.Redraw()
+            G.user.PrintDiff(actual)
+            G.user.PrintData()
+        else:
+            G.intf.Redraw()
+
+        self.FinishFlush(ops, batch)
+        if not failed:
+            if mismatches or batch['mismatches']:
+                details = ", ".join(["%s %+g" % (i, round(j, 1)) for (i, j) in sorted(mismatches.items())])
+                DEBUG.Display("%d changes written, the server's result differs from the prediction (%s)" %
+                              (len(ops), details or "task values"))
+            else:
+                DEBUG.Display("%d changes written" % len(ops))
+
+        if self.flushAgain:
+            self.FlushAsync()
 
 
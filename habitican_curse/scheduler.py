@@ -0,0 +1,137 @@
+""" Module "Scheduler" : Pacing of requests to the Habitica server
+
+    Habitica rate-limits API calls per user and reports the remaining budget
+    in the X-RateLimit-* headers of every response (and Retry-After on a 429).
+    The scheduler paces requests with a token bucket refilled at the rate
+    the server currently allows, and limits the number of requests in flight
+    to what is left of the budget.
+"""
+# Standard Library Imports
+import re
+import time
+import threading
+from datetime import datetime
+from dateutil import parser, tz
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+# Habitica's documented budget, used until the server tells us otherwise
+RATE_LIMIT  = 30    # Requests...
+RATE_WINDOW = 60    # ...per this many seconds
+
+
+def ParseReset(value, now):
+    # X-RateLimit-Reset is either a (JavaScript) date or a number of
+    # seconds/an epoch timestamp. Returns the reset time as an epoch, or None.
+    try:
+        number = float(value)
+        if number > now:       # Epoch, possibly in milliseconds
+            return number/1000 if number > now*100 else number
+        return now + number    # Delta in seconds
+    except ValueError:
+        pass
+
+    try:
+        # Drop the "(Coordinated Universal Time)" suffix of Date.toString()
+        date = parser.parse(re.sub(r'\(.*\)', '', value))
+    except (ValueError, OverflowError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=tz.tzutc())
+    return (date - datetime(1970, 1, 1, tzinfo=tz.tzutc())).total_seconds()
+
+
+class RateLimiter(object):
+    """ Token bucket driven by the server's rate-limit headers """
+
+    def __init__(self, maxConcurrency, limit=RATE_LIMIT, window=RATE_WINDOW):
+        self.cond = threading.Condition()
+
+        self.maxConcurrency = maxConcurrency
+        self.inFlight = 0
+
+        self.capacity = float(limit)
+        self.tokens = float(limit)
+        self.rate = float(limit)/window      # Tokens per second
+        self.lastRefill = time.time()
+
+        self.remaining = None                # Budget reported by the server
+        self.pausedUntil = 0                 # Set by Retry-After
+
+    def Refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill)*self.rate)
+        self.lastRefill = now
+
+    def Concurrency(self):
+        # Requests allowed in flight: never more than what is left of the
+        # server's budget
+        if self.remaining is None:
+            return self.maxConcurrency
+        return max(1, min(self.maxConcurrency, self.remaining))
+
+    def Acquire(self):
+        # Block until a request may be sent
+        with self.cond:
+            while(1):
+                now = time.time()
+                self.Refill(now)
+
+                if now < self.pausedUntil:
+                    wait = self.pausedUntil - now
+                elif self.inFlight >= self.Concurrency():
+                    wait = None            # Woken up by Release
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens)/self.rate
+                else:
+                    self.tokens -= 1
+                    self.inFlight += 1
+                    return
+
+                self.cond.wait(wait)
+
+    def Release(self, headers=None):
+        # Account for a finished request and learn from its response headers
+        with self.cond:
+            self.inFlight -= 1
+            if headers is not None:
+                self.Update(headers)
+            self.cond.notify_all()
+
+    def Update(self, headers):
+        now = time.time()
+
+        limit = headers.get('X-RateLimit-Limit')
+        if limit is not None and limit.isdigit() and int(limit) > 0:
+            self.capacity = float(limit)
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is None or not remaining.isdigit():
+            return
+        self.remaining = int(remaining)
+
+        # Spread what is left of the budget over the rest of the window
+        reset = headers.get('X-RateLimit-Reset')
+        resetAt = ParseReset(reset, now) if reset is not None else None
+        if resetAt is None or resetAt <= now:
+            return
+
+        self.Refill(now)
+        self.rate = max(self.remaining, 1)/(resetAt - now)
+        self.tokens = min(self.tokens, self.remaining)
+        if self.remaining == 0:
+            self.pausedUntil = max(self.pausedUntil, resetAt)
+
+        logger.debug("Rate limit: %d left, %.2f requests/s" % (self.remaining, self.rate))
+
+    def Pause(self, seconds):
+        # Stop sending anything for a while (429 with Retry-After)
+        with self.cond:
+            self.pausedUntil = max(self.pausedUntil, time.time() + seconds)
+            self.tokens = 0
+            self.cond.notify_all()
+
+        logger.warn("Rate limited by the server, pausing for %d seconds" % seconds)
@@ -0,0 +1,176 @@
+""" Module "Scoring" : Local model of Habitica's task scoring
+
+    Predicts what scoring a task does to the task value and to the user's
+    health, experience, gold, mana and level, following the formulas of the
+    Habitica server (common/script/ops/scoreTask.js), so that the interface
+    can show the outcome before the server has answered. Critical hits,
+    drops, quest progress and automatic stat allocation are not modelled;
+    the server's answer always wins.
+"""
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+# Task values are clamped to this range before computing a delta
+MAX_TASK_VALUE = 21.27
+MIN_TASK_VALUE = -47.27
+
+CLOSE_ENOUGH = 0.00001
+
+# Largest differences between a prediction and the server's answer which
+# are not reported as a mismatch
+TOLERANCE = {'delta': 0.01, 'hp': 0.1, 'mp': 0.5, 'gp': 0.1, 'exp': 1, 'lvl': 0}
+
+STAT_FIELDS = ['hp', 'mp', 'gp', 'exp', 'lvl']
+
+
+def ClampValue(value):
+    return max(MIN_TASK_VALUE, min(MAX_TASK_VALUE, value))
+
+def ChecklistBonus(task, delta):
+    # Completed checklist items make a TODO worth more
+    if task['type'] == "todo" and task['checklistDone'] > 0:
+        return delta * (1 + task['checklistDone'])
+    return delta
+
+def TaskDelta(task, direction):
+    # Change of the task value when scoring it
+    delta = 0.9747**ClampValue(task['value'])
+    if direction == "down":
+        delta = -delta
+    return ChecklistBonus(task, delta)
+
+def ReverseDelta(task):
+    # Change of the task value when scoring it down: undoes an 'up' score,
+    # i.e. finds the value v with v + 0.9747^v == current value
+    current = ClampValue(task['value'])
+    guess = current - 0.9747**current
+    while(1):
+        diff = current - (guess + 0.9747**guess)
+        if abs(diff) < CLOSE_ENOUGH:
+            break
+        guess += diff
+
+    return ChecklistBonus(task, guess - current)
+
+def ValueDelta(task, direction):
+    # Change of the task value when scoring it
+    if direction == "down":
+        return ReverseDelta(task)
+    return TaskDelta(task, direction)
+
+def ToNextLevel(lvl):
+    return int(round((lvl**2*0.25 + 10*lvl + 139.75)/10)*10)
+
+def TaskState(task, value=None):
+    # What the model needs to know about a task.Task object
+    checklistDone = 0
+    if hasattr(task, "ChecklistTuple"):
+        checklistDone = task.ChecklistTuple()[0]
+
+    return {'id': task.taskID,
+            'type': task.task_type,
+            'value': task.value if value is None else value,
+            'priority': task.priority,
+            'streak': getattr(task, "streak", 0),
+            'checklistDone': checklistDone}
+
+def JSONState(task, value):
+    # The same for task JSON from the server, with the given value
+    return {'id': task['id'],
+            'type': task['type'],
+            'value': value,
+            'priority': task.get('priority', 1),
+            'streak': task.get('streak', 0),
+            'checklistDone': len([i for i in task.get('checklist', []) if i['completed']])}
+
+def ScoredFrom(task, value, direction):
+    # Whether the value of the task (JSON from the server) is what a score
+    # in that direction makes of the given value
+    expected = value + ValueDelta(JSONState(task, value), direction)
+    return abs(task['value'] - expected) <= TOLERANCE['delta']
+
+
+def AddPoints(stats, attrs, task, direction, delta):
+    stats['exp'] += round(delta * (1 + attrs['int']*0.025) * task['priority'] * 6)
+
+    gp = delta * task['priority'] * (1 + attrs['per']*0.02)
+    if task['streak']:
+        streak = task['streak'] - 1 if direction == "down" else task['streak']
+        gp *= 1 + streak/100.0
+    stats['gp'] += gp
+
+def SubtractPoints(stats, attrs, task, delta):
+    conBonus = max(1 - attrs['con']/250.0, 0.1)
+    stats['hp'] += round(delta * conBonus * task['priority'] * 2 * 10)/10
+
+def GainMP(stats, amount):
+    stats['mp'] = max(0, min(stats['maxMP'], stats['mp'] + amount))
+
+def UpdateStats(stats):
+    # Level ups refill health; death and level loss are left to the server
+    while stats['exp'] >= ToNextLevel(stats['lvl']):
+        stats['exp'] -= ToNextLevel(stats['lvl'])
+        stats['lvl'] += 1
+        stats['hp'] = stats['maxHealth']
+
+    stats['exp'] = max(stats['exp'], 0)
+    stats['hp'] = max(stats['hp'], 0)
+    stats['toNextLevel'] = ToNextLevel(stats['lvl'])
+
+def Score(stats, attrs, task, direction):
+    # Score a task (see TaskState) for a user with the given stats (hp, mp,
+    # gp, exp, lvl, maxMP, maxHealth) and computed attributes
+    # (H.GetUserStats). The stats and the task are updated in place; the
+    # change of the task value is returned.
+    before = task['value']
+    delta = ValueDelta(task, direction)
+    task['value'] += delta
+
+    if task['type'] == "habit":
+        if delta > 0:
+            AddPoints(stats, attrs, task, direction, delta)
+        else:
+            SubtractPoints(stats, attrs, task, delta)
+        mp = max(0.25, 0.0025*stats['maxMP'])
+    else:
+        if direction == "down":
+            # Unchecking takes back what checking gave
+            delta = TaskDelta(task, direction)
+        AddPoints(stats, attrs, task, direction, delta)
+        mp = max(1, 0.01*stats['maxMP'])
+
+        if task['type'] == "daily":
+            if direction == "up":
+                task['streak'] += 1
+            else:
+                task['streak'] = max(task['streak'] - 1, 0)
+
+    GainMP(stats, mp if direction == "up" else -mp)
+    UpdateStats(stats)
+
+    return task['value'] - before
+
+def Predict(stats, attrs, scores):
+    # Score a sequence of (task state, direction) pairs. Returns the stats
+    # after all of them and the predicted value delta of each score.
+    stats = dict(stats)
+    tasks = {}
+    deltas = []
+    for (task, direction) in scores:
+        task = tasks.setdefault(task['id'], dict(task))
+        deltas.append(Score(stats, attrs, task, direction))
+
+    return stats, deltas
+
+def Mismatches(predicted, actual):
+    # Fields in which the server's answer differs from the prediction,
+    # as {field: actual - predicted}
+    result = {}
+    for (field, tolerance) in TOLERANCE.items():
+        if field not in predicted or field not in actual:
+            continue
+        if abs(actual[field] - predicted[field]) > tolerance:
+            result[field] = actual[field] - predicted[field]
+    return result
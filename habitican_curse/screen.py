@@ -2,10 +2,13 @@
 
     All screen related functions such as displaying text, colors, background,
     saving/restoring context etc. go here.
+
+    Output is staged in the window and sent to the terminal as one frame
+    (Commit) when input is read or a message is shown, not after every
+    string displayed.
 """
 # Standard Library Imports
 import curses
-import tempfile
 import math
 import threading
 
@@ -25,15 +28,11 @@ class Screen(object):
 
         # These are special context registers.
         # Use these to store some important backtrack points.
-        self.ctxts = []
-        for i in xrange(C.NUM_CONTEXT_REGISTERS):
-            self.ctxts += [tempfile.TemporaryFile()]
-
-        self.active_registers = [False]*C.NUM_CONTEXT_REGISTERS
+        # Contexts are in-memory copies of the window (see Snapshot).
+        self.ctxts = [None]*C.NUM_CONTEXT_REGISTERS
 
         # This is the stack for saving contexts.
         # Use these to get a proper order of backtrack points
-        self.stackFile = tempfile.TemporaryFile()
         self.stack = []
         self.SCR_X=0
         self.SCR_Y=0
@@ -88,7 +87,14 @@ class Screen(object):
         self.SCR_MENU_ITEM_WIDTH = (self.SCR_X - 10)/3
 
     def Refresh(self):
-        self.screen.refresh()
+        self.Commit()
+
+    def Commit(self):
+        # Send everything displayed since the last frame to the terminal
+        self.Lock()
+        self.screen.noutrefresh()
+        curses.doupdate()
+        self.Release()
 
     def Erase(self):
         self.screen.erase()
@@ -96,14 +102,30 @@ class Screen(object):
     def Clear(self):
         self.screen.clear()
 
+    def Snapshot(self, copy=None):
+        # Copy the window contents (characters and attributes) into an
+        # off-screen window, reusing 'copy' if it has the right size
+        self.Lock()
+        size = self.screen.getmaxyx()
+        if copy is None or copy.getmaxyx() != size:
+            copy = curses.newwin(size[0], size[1], 0, 0)
+        self.screen.overwrite(copy)
+        self.Release()
+        return copy
+
+    def Paste(self, copy):
+        # Put a copy made by Snapshot back on the window
+        self.Lock()
+        copy.overwrite(self.screen)
+        self.screen.touchwin()
+        self.Release()
+
     def SaveInRegister(self, register):
         # Should be between 0 and C.NUM_CONTEXT_REGISTERS-1
         if register >= C.NUM_CONTEXT_REGISTERS:
             return
 
-        self.ctxts[register].seek(0)
-        self.screen.putwin(self.ctxts[register])
-        self.active_registers[register] = True
+        self.ctxts[register] = self.Snapshot(self.ctxts[register])
 
     def RestoreRegister(self, register):
         # Should be between 0 and C.NUM_CONTEXT_REGISTERS-1
@@ -111,27 +133,26 @@ class Screen(object):
             return
 
         # Register is empty
-        if not self.active_registers[register]:
+        if self.ctxts[register] is None:
             return
 
-        self.ctxts[register].seek(0)
-        self.screen = curses.getwin(self.ctxts[register])
+        self.Paste(self.ctxts[register])
 
         # Clear Notification Line
         DEBUG.Display(" ")
         self.Refresh()
 
     def Save(self):
-        self.stack.append(self.stackFile.tell())
-        self.screen.putwin(self.stackFile)
+        self.stack.append(self.Snapshot())
+        if len(self.stack) > C.CONTEXT_STACK_SIZE:
+            self.stack.pop(0)
 
     def Restore(self):
         # Stack cannot be empty
         if len(self.stack) == 0:
             return
 
-        self.stackFile.seek(self.stack[-1])
-        self.screen = curses.getwin(self.stackFile)
+        self.Paste(self.stack.pop())
 
         # Clear Notification Line
         DEBUG.Display(" ")
@@ -164,15 +185,21 @@ class Screen(object):
             logger.debug("Curses error: Pads throw incorrect size errors")
             pass
 
-        self.Refresh()
         self.Release()
 
     def Highlight(self, string, x=0, y=0):
         self.Display(string, x, y, highlight=True)
 
-    def GetCharacter(self):
+    def GetCharacter(self, timeout=None):
+        # With a timeout (in milliseconds), -1 is returned if no key was
+        # pressed in time
         self.Lock()
+        self.Commit()
+        if timeout is not None:
+            self.screen.timeout(timeout)
         c = self.screen.getch()
+        if timeout is not None:
+            self.screen.timeout(-1)
         self.Release()
         return c
 
@@ -189,8 +216,18 @@ class Screen(object):
         curses.curs_set(0)
 
     def ClearRegion(self, x1, x2, y1, y2):
-        for i in xrange(x1, x2):
-            self.Display(" "*(y2 - y1), i, y1)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        self.Lock()
+        try:
+            # A window over the region shares its cells with the screen
+            self.screen.derwin(x2 - x1, y2 - y1, x1, y1).erase()
+        except curses.error:
+            # The region does not fit on the screen
+            for i in xrange(x1, x2):
+                self.Display(" "*(y2 - y1), i, y1)
+        self.Release()
 
     def ClearTextArea(self):
         # Clear the area where tasks are displayed
@@ -248,13 +285,23 @@ class Screen(object):
 
         return inpString
 
+    def VerticalLine(self, x, y, length, color):
+        # A column of blank cells in one go
+        if length <= 0:
+            return
+
+        try:
+            self.screen.vline(x, y, ord(' ') | curses.color_pair(color) | curses.A_BOLD, length)
+        except curses.error:
+            logger.debug("Curses error: line does not fit on the screen")
+
     def ScrollBar(self, X, Y, start, end, length, rows = -1):
-        self.Lock()
         if length == 0:       # Empty Menu
             return
         if rows == -1:
             rows = C.SCR_MAX_MENU_ROWS
 
+        self.Lock()
         start_space = int(math.ceil((start * 1.0)/(length) * rows))
         end_space   = int(math.floor(((length - end) * 1.0)/(length) * rows))
 
@@ -263,18 +310,12 @@ class Screen(object):
         self.Display(C.SYMBOL_DOWN_TRIANGLE,X+rows, Y,
                                     color=C.SCR_COLOR_DARK_GRAY, bold=True)
 
-        starting = X
-        ending   = X + rows
-        for i in xrange(start_space):
-            self.Display(" ", X+i, Y, color=C.SCR_COLOR_WHITE_GRAY_BGRD,bold=True)
-            starting = X + i
-
-        for i in xrange(end_space):
-            self.Display(" ",X+rows-1-i, Y,
-                             color=C.SCR_COLOR_WHITE_GRAY_BGRD,bold=True)
-            ending = X + rows - 1 - i
-
-        for i in xrange(starting, ending):
-            self.Display(" ",i, Y,color=C.SCR_COLOR_GRAY_WHITE_BGRD, bold=True)
+        # The track above and below the thumb, then the thumb, which covers
+        # the last cell of the track above
+        starting = X + max(start_space - 1, 0)
+        ending   = X + rows - max(end_space - 1, 0) - (1 if end_space > 0 else 0)
+        self.VerticalLine(X, Y, start_space, C.SCR_COLOR_WHITE_GRAY_BGRD)
+        self.VerticalLine(X+rows-end_space, Y, end_space, C.SCR_COLOR_WHITE_GRAY_BGRD)
+        self.VerticalLine(starting, Y, ending - starting, C.SCR_COLOR_GRAY_WHITE_BGRD)
 
         self.Release()
@@ -0,0 +1,64 @@
+""" Module "Snapshot" : Local copy of the user and the tasks
+
+    A compact copy of the user and of the task model is written after every
+    successful fetch and on exit. At startup the menus are built from it
+    right away, marked as stale, while the data is revalidated against the
+    server in the background.
+"""
+# Standard Library Imports
+import os
+import json
+import time
+import threading
+
+# Custom Module Imports
+import config as C
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+SNAPSHOT_FILE = "snapshot.json"
+SNAPSHOT_VERSION = 1
+
+# Task fields which are not needed to display or score a task
+SNAPSHOT_DROP_FIELDS = ['history']
+
+# Snapshots are written from the worker threads too
+lock = threading.Lock()
+
+
+def CompactTask(task_json):
+    return dict((i, j) for (i, j) in task_json.items()
+                if i not in SNAPSHOT_DROP_FIELDS)
+
+def ReadSnapshot():
+    try:
+        with open(C.getDataFile(SNAPSHOT_FILE), 'r') as f:
+            snapshot = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        logger.debug("No usable snapshot: %s" % str(e))
+        return None
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+
+    # Never show the tasks of another account
+    if snapshot.get('uuid') != C.getConfig("uuid"):
+        return None
+
+    return snapshot
+
+def WriteSnapshot(task_json, user_json):
+    snapshot = {'version': SNAPSHOT_VERSION, 'uuid': C.getConfig("uuid"),
+                'saved': time.time(), 'user': user_json,
+                'tasks': [CompactTask(i) for i in task_json]}
+    try:
+        fileName = C.getDataFile(SNAPSHOT_FILE)
+        with lock:
+            with open(fileName+".tmp", 'w') as f:
+                json.dump(snapshot, f)
+            os.rename(fileName+".tmp", fileName)
+    except (IOError, OSError) as e:
+        logger.warn("Could not write snapshot: %s" % str(e))
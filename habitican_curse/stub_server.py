@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+""" Module "Stub Server" : Local stand-in for the Habitica API
+
+    Implements the V3 endpoints used by Habitican Curse on top of fixture
+    data, with configurable latency, error rate and rate limiting, so that
+    flushes and startup can be exercised offline. This module only depends
+    on the standard library and is run as a script:
+
+        python habitican_curse/stub_server.py --port 8080 --latency 200
+
+    and the app is pointed at it with a line in ~/.habiticarc:
+
+        api_url=http://localhost:8080/api/v3
+"""
+# Standard Library Imports
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v3"
+
+WEEKDAYS = {'m': True, 't': True, 'w': True, 'th': True, 'f': True, 's': True, 'su': True}
+
+
+################################
+## Fixture Data                #
+################################
+
+def Timestamp(offset=0):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time.time() + offset))
+
+def FixtureTask(task_type, number):
+    task = {'id': str(uuid.uuid4()), 'type': task_type, 'text': "%s %d" % (task_type.capitalize(), number),
+            'notes': "", 'priority': random.choice([0.1, 1, 1.5, 2]), 'value': 0.0,
+            'createdAt': Timestamp(-86400*number), 'updatedAt': Timestamp(-3600*number),
+            'challenge': {}, 'history': []}
+
+    if task_type == "habit":
+        task['up'] = True
+        task['down'] = number % 3 != 0
+        task['history'] = [{'date': (time.time() - 86400*i)*1000, 'value': 0.0} for i in xrange(30)]
+    if task_type == "daily":
+        task['completed'] = False
+        task['frequency'] = 'weekly'
+        task['everyX'] = 1
+        task['repeat'] = WEEKDAYS.copy()
+        task['startDate'] = Timestamp(-86400*30)
+        task['streak'] = 0
+    if task_type in ["daily", "todo"]:
+        task['completed'] = False
+        task['checklist'] = [{'id': str(uuid.uuid4()), 'text': "Step %d" % i, 'completed': False}
+                             for i in xrange(number % 4)]
+    return task
+
+def FixtureData(numTasks, numMessages):
+    gear = {'weapon': 'weapon_warrior_1', 'armor': 'armor_warrior_1',
+            'head': 'head_warrior_1', 'shield': 'shield_warrior_1'}
+    flat = dict((key, {'key': key, 'klass': 'warrior', 'str': 3, 'int': 0, 'per': 0, 'con': 2,
+                       'text': key, 'notes': "", 'value': 10})
+                for key in gear.values())
+
+    user = {'_id': str(uuid.uuid4()), '_v': 1,
+            'stats': {'hp': 50.0, 'maxHealth': 50, 'mp': 30.0, 'maxMP': 40, 'gp': 100.0,
+                      'exp': 10.0, 'toNextLevel': 150, 'lvl': 5, 'class': 'warrior',
+                      'str': 2, 'int': 0, 'per': 1, 'con': 2,
+                      'buffs': {'str': 0, 'int': 0, 'per': 0, 'con': 0, 'stealth': 0}},
+            'items': {'gear': {'equipped': gear, 'owned': dict((i, True) for i in gear.values())}},
+            'party': {'_id': 'party', 'quest': {'key': 'dilatory', 'progress': {'up': 3.5, 'collect': {}}}},
+            'preferences': {}, 'inbox': {'messages': {}}, 'achievements': {}, 'history': {'exp': []}}
+
+    tasks = []
+    for i in xrange(numTasks):
+        tasks.append(FixtureTask(["habit", "daily", "todo"][i % 3], i/3 + 1))
+
+    content = {'quests': {'dilatory': {'key': 'dilatory', 'text': "The Dread Drag'on of Dilatory",
+                                       'notes': "", 'boss': {'name': "Dread Drag'on", 'hp': 5000000,
+                                                             'str': 1, 'rage': {}}}},
+               'gear': {'flat': flat},
+               'pets': {}, 'mounts': {}, 'spells': {}}
+
+    chat = []
+    for i in xrange(numMessages):
+        chat.append({'id': str(uuid.uuid4()), 'text': "Message number %d from the stub server" % i,
+                     'user': "member%d" % (i % 5), 'timestamp': (time.time() - 600*i)*1000})
+
+    party = {'_id': 'party', 'name': "Stub Party", 'chat': chat,
+             'quest': {'key': 'dilatory', 'active': True, 'progress': {'hp': 4999000.0, 'collect': {}}}}
+
+    return {'user': user, 'tasks': tasks, 'content': content, 'party': party}
+
+
+################################
+## Server State                #
+################################
+
+class StubState(object):
+    """ Fixture data plus the fault injection settings, shared by all
+    request handlers """
+
+    def __init__(self, data, options):
+        self.data = data
+        self.options = options
+        self.lock = threading.Lock()
+
+        # Rate limiting window
+        self.windowStart = time.time()
+        self.windowCount = 0
+
+    def RateLimit(self):
+        # Returns (headers, allowed)
+        if self.options.rate_limit <= 0:
+            return {}, True
+
+        with self.lock:
+            now = time.time()
+            if now - self.windowStart >= self.options.window:
+                self.windowStart = now
+                self.windowCount = 0
+            self.windowCount += 1
+
+            remaining = max(self.options.rate_limit - self.windowCount, 0)
+            reset = self.windowStart + self.options.window
+            headers = {'X-RateLimit-Limit': str(self.options.rate_limit),
+                       'X-RateLimit-Remaining': str(remaining),
+                       'X-RateLimit-Reset': str(int(reset*1000))}
+
+            if self.windowCount > self.options.rate_limit:
+                headers['Retry-After'] = str(int(reset - now) + 1)
+                return headers, False
+
+        return headers, True
+
+    def Task(self, task_id):
+        for task in self.data['tasks']:
+            if task['id'] == task_id:
+                return task
+        return None
+
+    def Touch(self):
+        # Every change to the user bumps its version
+        self.data['user']['_v'] += 1
+        return self.data['user']['_v']
+
+    def Score(self, task, direction):
+        value = min(max(task['value'], -47.27), 21.27)
+        if direction == "up":
+            delta = 0.9747**value
+        else:
+            # Scoring down undoes an 'up' score, like the Habitica server
+            before = value - 0.9747**value
+            for i in xrange(50):
+                before += value - (before + 0.9747**before)
+            delta = before - value
+        if task['type'] == "todo":
+            delta *= 1 + len([i for i in task.get('checklist', []) if i['completed']])
+        task['value'] += delta
+        task['updatedAt'] = Timestamp()
+        if task['type'] in ["daily", "todo"]:
+            task['completed'] = direction == "up"
+        if task['type'] == "daily":
+            task['streak'] = task.get('streak', 0) + 1 if direction == "up" else max(task.get('streak', 0) - 1, 0)
+
+        stats = self.data['user']['stats']
+        if delta > 0:
+            stats['exp'] += round(delta * task['priority'] * 6)
+            stats['gp'] += delta * task['priority']
+            if stats['exp'] >= stats['toNextLevel']:
+                stats['exp'] -= stats['toNextLevel']
+                stats['lvl'] += 1
+        else:
+            stats['hp'] += round(delta * task['priority'] * 2 * 10)/10
+        stats['mp'] = min(max(stats['mp'] + (1 if delta > 0 else -1), 0), stats['maxMP'])
+
+        result = dict((i, stats[i]) for i in ['hp', 'mp', 'exp', 'gp', 'lvl'])
+        result['delta'] = delta
+        result['_tmp'] = {}
+        return result
+
+
+################################
+## Request Handler             #
+################################
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Routes V3 API requests to the shared StubState """
+
+    protocol_version = "HTTP/1.1"   # Keep-alive, like the real server
+    state = None
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+    def Reply(self, status, body=None, headers={}):
+        payload = json.dumps(body) if body is not None else ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for (key, value) in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def Success(self, data, status=200, headers={}):
+        with self.state.lock:
+            userV = self.state.data['user']['_v']
+        self.Reply(status, {'success': True, 'data': data, 'userV': userV}, headers)
+
+    def Failure(self, status, message, headers={}):
+        self.Reply(status, {'success': False, 'error': 'Error', 'message': message}, headers)
+
+    def ReadBody(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        if length == 0:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def Handle(self, method):
+        options = self.state.options
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        path = url.path
+        body = self.ReadBody() if method in ["POST", "PUT"] else None
+
+        # Simulated network and server delays
+        if options.latency > 0 or options.jitter > 0:
+            time.sleep((options.latency + random.uniform(0, options.jitter))/1000.0)
+
+        rateHeaders, allowed = self.state.RateLimit()
+        if not allowed:
+            return self.Failure(429, "Too many requests", rateHeaders)
+
+        if random.random() < options.error_rate:
+            return self.Failure(random.choice([500, 502, 503]), "Injected failure", rateHeaders)
+
+        if not path.startswith(API_PREFIX):
+            return self.Failure(404, "Not found", rateHeaders)
+        path = path[len(API_PREFIX):].rstrip("/")
+
+        for (routeMethod, pattern, handler) in ROUTES:
+            match = re.match("^" + pattern + "$", path)
+            if routeMethod == method and match:
+                request = {'query': query, 'body': body, 'headers': self.headers}
+                with self.state.lock:
+                    result = handler(self.state, request, *match.groups())
+                status, data = result[0], result[1]
+                headers = dict(rateHeaders)
+                if len(result) > 2:
+                    headers.update(result[2])
+
+                if status >= 400:
+                    return self.Failure(status, str(data), headers)
+                if status == 304:
+                    return self.Reply(304, None, headers)
+                return self.Success(data, status, headers)
+
+        return self.Failure(404, "Not found", rateHeaders)
+
+    def do_GET(self):
+        self.Handle("GET")
+
+    def do_POST(self):
+        self.Handle("POST")
+
+    def do_PUT(self):
+        self.Handle("PUT")
+
+    def do_DELETE(self):
+        self.Handle("DELETE")
+
+
+################################
+## Routes                      #
+################################
+
+def GetStatus(state, request):
+    return 200, {'status': 'up'}
+
+def GetUser(state, request):
+    user = state.data['user']
+    query = request['query']
+    if 'userFields' not in query:
+        return 200, user
+
+    # Field projection, e.g. userFields=stats,items.gear.equipped
+    projected = {'_id': user['_id']}
+    for field in ",".join(query['userFields']).split(","):
+        source, target = user, projected
+        parts = field.strip().split(".")
+        for part in parts[:-1]:
+            if part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return 200, projected
+
+def GetTasks(state, request):
+    types = {'habits': ["habit"], 'dailys': ["daily"], 'todos': ["todo"], 'rewards': ["reward"]}
+    task_type = request['query'].get('type', [None])[0]
+    if task_type == "completedTodos":
+        return 200, [i for i in state.data['tasks'] if i['type'] == "todo" and i.get('completed')]
+    if task_type is not None and task_type not in types:
+        return 400, "Unknown task type"
+
+    wanted = types.get(task_type, ["habit", "daily", "todo", "reward"])
+    return 200, [i for i in state.data['tasks'] if i['type'] in wanted and
+                 not (i['type'] == "todo" and i.get('completed') and task_type is None)]
+
+def GetTask(state, request, task_id):
+    task = state.Task(task_id)
+    if task is None:
+        return 404, "Task not found"
+    return 200, task
+
+def CreateTasks(state, request):
+    body = request['body']
+    if body is None:
+        return 400, "Missing body"
+
+    created = []
+    for obj in (body if isinstance(body, list) else [body]):
+        task_id = obj.get('id', str(uuid.uuid4()))
+        if state.Task(task_id) is not None:
+            return 409, "Task id already in use"
+        task = FixtureTask(obj.get('type', "todo"), 0)
+        task.update(copy.deepcopy(obj))
+        task.update({'id': task_id, 'value': 0.0, 'createdAt': Timestamp(), 'updatedAt': Timestamp()})
+        created.append(task)
+
+    state.data['tasks'] = created + state.data['tasks']
+    state.Touch()
+    return 201, created if isinstance(body, list) else created[0]
+
+def UpdateTask(state, request, task_id):
+    task = state.Task(task_id)
+    if task is None:
+        return 404, "Task not found"
+
+    for (key, value) in (request['body'] or {}).items():
+        if key not in ['id', '_id', 'type', 'value', 'createdAt', 'updatedAt', 'history', 'challenge']:
+            task[key] = value
+    task['updatedAt'] = Timestamp()
+    state.Touch()
+    return 200, task
+
+def DeleteTask(state, request, task_id):
+    task = state.Task(task_id)
+    if task is None:
+        return 404, "Task not found"
+
+    state.data['tasks'].remove(task)
+    state.Touch()
+    return 200, {}
+
+def ScoreTask(state, request, task_id, direction):
+    task = state.Task(task_id)
+    if task is None:
+        return 404, "Task not found"
+
+    result = state.Score(task, direction)
+    state.Touch()
+    return 200, result
+
+def GetContent(state, request):
+    if state.options.content_etag is None:
+        digest = hashlib.md5(json.dumps(state.data['content'], sort_keys=True)).hexdigest()
+        state.options.content_etag = 'W/"%s"' % digest
+
+    headers = {'ETag': state.options.content_etag}
+    if request['headers'].getheader('If-None-Match') == state.options.content_etag:
+        return 304, None, headers
+    return 200, state.data['content'], headers
+
+def GetParty(state, request):
+    return 200, state.data['party']
+
+def GetPartyChat(state, request):
+    return 200, state.data['party']['chat']
+
+ROUTES = [
+    ("GET",    r"/status",                          GetStatus),
+    ("GET",    r"/user",                            GetUser),
+    ("GET",    r"/tasks/user",                      GetTasks),
+    ("POST",   r"/tasks/user",                      CreateTasks),
+    ("GET",    r"/tasks/([^/]+)",                   GetTask),
+    ("PUT",    r"/tasks/([^/]+)",                   UpdateTask),
+    ("DELETE", r"/tasks/([^/]+)",                   DeleteTask),
+    ("POST",   r"/tasks/([^/]+)/score/(up|down)",   ScoreTask),
+    ("GET",    r"/content",                         GetContent),
+    ("GET",    r"/groups/party",                    GetParty),
+    ("GET",    r"/groups/party/chat",               GetPartyChat),
+]
+
+
+class ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def ParseArguments(argv):
+    argParser = argparse.ArgumentParser(description="Local stand-in for the Habitica V3 API")
+    argParser.add_argument("--port", type=int, default=8080)
+    argParser.add_argument("--fixture", help="JSON file with 'user', 'tasks', 'content' and 'party'")
+    argParser.add_argument("--tasks", type=int, default=60, help="Number of generated tasks")
+    argParser.add_argument("--messages", type=int, default=200, help="Number of generated chat messages")
+    argParser.add_argument("--latency", type=float, default=0, help="Delay added to every request (ms)")
+    argParser.add_argument("--jitter", type=float, default=0, help="Random extra delay, up to this many ms")
+    argParser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests failing with a 5xx")
+    argParser.add_argument("--rate-limit", type=int, default=30, help="Requests per window, 0 to disable")
+    argParser.add_argument("--window", type=float, default=60, help="Rate limit window (s)")
+    argParser.add_argument("--seed", type=int, help="Random seed, for reproducible runs")
+    options = argParser.parse_args(argv)
+    options.content_etag = None
+    return options
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO)
+    options = ParseArguments(argv)
+    if options.seed is not None:
+        random.seed(options.seed)
+
+    if options.fixture:
+        with open(options.fixture, 'r') as f:
+            data = json.load(f)
+    else:
+        data = FixtureData(options.tasks, options.messages)
+
+    state = StubState(data, options)
+
+    StubHandler.state = state
+    server = ThreadedServer(("localhost", options.port), StubHandler)
+    logger.info("Serving the Habitica stand-in on http://localhost:%d%s" % (options.port, API_PREFIX))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
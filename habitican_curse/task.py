@@ -71,6 +71,11 @@ def ChecklistMenu(checklist):
     menuObj.SetXY(C.SCR_MAX_MENU_ROWS+7, 5)
     return menuObj
 
+def CompactChecklist(checklist):
+    # Only what is displayed and sent back of the checklist items
+    return [{'id': i['id'], 'text': i['text'], 'completed': i['completed']}
+            for i in checklist]
+
 def DummyChecklistItem():
     # Return an "Add an item"-named dummy checklist item
     newItem = {}
@@ -87,16 +92,22 @@ class Task(object):
     function in the derived classes
     """
 
+    # Only the fields needed for displaying and editing are kept; the JSON
+    # of the task is rebuilt from them by ToJSON
+    __slots__ = ['task_type', 'text', 'taskID', 'updatedAt', 'createdAt',
+                 'priority', 'value', 'challenge', 'color', 'difficulty',
+                 'x', 'y']
+
     def __init__(self, data):
-        self.data = data          # JSON response
 
         # Basic Details
         self.text         = data['text'].encode("utf-8")
         self.taskID       = data['id']
-        self.dateCreated  = H.DateTime(str(data['createdAt']))
+        self.updatedAt    = data.get('updatedAt', None)
+        self.createdAt    = str(data['createdAt'])
         self.priority     = data['priority']
         self.value        = data['value']
-        self.isChallenge = data.has_key('challenge') and data['challenge'] != {}
+        self.challenge    = data.get('challenge', {})
 
         # Derived Details
         self.color       = ValueToColor(self.value)
@@ -106,10 +117,29 @@ class Task(object):
         self.x           = 0
         self.y           = 0
 
+    @property
+    def isChallenge(self):
+        return self.challenge != {}
+
+    def ToJSON(self):
+        # JSON of the task as the server knows it (e.g. for an UpdateTask
+        # body), with the fields which are kept
+        data = {'id': self.taskID, 'type': self.task_type,
+                'text': self.text.decode("utf-8"), 'createdAt': self.createdAt,
+                'priority': self.priority, 'value': self.value,
+                'challenge': self.challenge}
+        if self.updatedAt is not None:
+            data['updatedAt'] = self.updatedAt
+        return data
+
     def SetXY(self, x=0, y=0):
         self.x = x
         self.y = y
 
+    def SetValue(self, value):
+        self.value = value
+        self.color = ValueToColor(value)
+
     def Display(self):
         #G.screen.RestoreRegister(0)
         G.screen.ClearTextArea()
@@ -134,7 +164,7 @@ class Task(object):
 
         # Date Created
         G.screen.Display("Date Created: ", X, Y,bold=True)
-        G.screen.Display(self.dateCreated.DateCreatedFormat(),X, Y+14,
+        G.screen.Display(H.DateTime(self.createdAt).DateCreatedFormat(),X, Y+14,
                          color=C.SCR_COLOR_MAGENTA,bold=True)
         X += 1
 
@@ -143,45 +173,55 @@ class Task(object):
     def ChangePriority(self, key):
         priorityDict = {"trivial": 0.1, "easy": 1, "medium": 1.5, "hard": 2}
         self.priority = priorityDict[key]
-        self.data['priority'] = self.priority
         self.difficulty = key
 
 
 class ChecklistItem(object):
     """ Class for holding a checklist item """
 
+    __slots__ = ['text', 'completed', 'ID', 'newName']
+
     def __init__(self, data):
 
         # Checklist Item Specifications
-        self.data      = data
         self.text      = data['text'].encode("utf-8")
         self.completed = data['completed']
         self.ID        = data['id']
         self.newName   = ""               # In case we change the name
 
+    def ToJSON(self):
+        return {'id': self.ID, 'text': self.text.decode("utf-8"),
+                'completed': self.completed}
+
     def Display(self): # Dummy
         return
 
     def Mark(self):
         self.completed ^= True
-        self.data['completed'] = self.completed
 
     def ChangeName(self):
         self.text = self.newName
-        self.data['text'] = self.text
 
 
 class Habit(Task):
     """ Class for holding a habit """
 
+    __slots__ = ['up', 'down']
+
     def __init__(self, data):
-        super(Habit, self).__init__(data)
         self.task_type = "habit"
+        super(Habit, self).__init__(data)
 
         # Special Attributes
         self.up   = data['up']
         self.down = data['down']
 
+    def ToJSON(self):
+        data = super(Habit, self).ToJSON()
+        data['up'] = self.up
+        data['down'] = self.down
+        return data
+
     def Display(self):
         X = super(Habit, self).Display()
         Y = self.y
@@ -191,10 +231,7 @@ class Habit(Task):
 
     def SetDirection(self, up=True, down=True):
         self.up = up
-        self.data['up'] = up
-        
         self.down = down
-        self.data['down'] = down
 
     def ShowChecklist(self, menuItem):
         # Dummy to avoid crashes
@@ -203,33 +240,50 @@ class Habit(Task):
 class Daily(Task):
     """ Class for holding a daily """
 
+    __slots__ = ['completed', 'checklist', 'frequency', 'repeat', 'everyX',
+                 'startDate', 'streak', 'isDue', 'checklistMenu']
+
     def __init__(self, data):
         self.task_type = "daily"
         super(Daily, self).__init__(data)
 
         # Special Attributes
         self.completed = data['completed']
-        self.checklist = data['checklist']
+        self.checklist = CompactChecklist(data['checklist'])
 
         self.frequency = data['frequency']
         self.repeat    = data['repeat']
         self.everyX    = data['everyX']
         self.startDate = str(data['startDate'])
+        self.streak    = data.get('streak', 0)
 
         # Is it due today?
-        self.isDue     = H.isDueDaily(self.data)
+        self.isDue     = H.isDueDaily(self.frequency, self.repeat, self.everyX, self.startDate)
         if not self.isDue:
             self.color = C.SCR_COLOR_NEUTRAL
 
 
-        # Checklist Menu. None if it is empty
-        self.checklistMenu = ChecklistMenu(self.checklist)
+        # Checklist Menu, built when it is first shown
+        self.checklistMenu = None
+
+    def ToJSON(self):
+        data = super(Daily, self).ToJSON()
+        data.update({'completed': self.completed, 'checklist': self.checklist,
+                     'frequency': self.frequency, 'repeat': self.repeat,
+                     'everyX': self.everyX, 'startDate': self.startDate,
+                     'streak': self.streak})
+        return data
 
     def ChecklistTuple(self):  # Return (done/total)
         done = len([i for i in self.checklist if i['completed']])
         total = len(self.checklist)
         return [done, total]
 
+    def SetValue(self, value):
+        super(Daily, self).SetValue(value)
+        if not self.isDue:
+            self.color = C.SCR_COLOR_NEUTRAL
+
     def Display(self):
         X = super(Daily, self).Display()
         Y = self.y
@@ -254,7 +308,7 @@ class Daily(Task):
 
     def ShowChecklist(self, menuItem):
         if self.checklistMenu == None:
-            return
+            self.checklistMenu = ChecklistMenu(self.checklist)
 
         G.screen.ClearTextArea()
         self.checklistMenu.Init()
@@ -267,20 +321,16 @@ class Daily(Task):
 
     def ChangeChecklist(self, checklist):
         self.checklist = checklist
-        self.data['checklist'] = checklist
 
     def SetWeekly(self, repeat):
         if self.frequency != "weekly":
             self.frequency = "weekly"
-            self.data['frequency'] = self.frequency
-            self.data['everyX'] = 1
             self.everyX = 1
 
         self.repeat = repeat
-        self.data['repeat'] = repeat
 
         # Is it due today?
-        self.isDue     = H.isDueDaily(self.data)
+        self.isDue     = H.isDueDaily(self.frequency, self.repeat, self.everyX, self.startDate)
         if not self.isDue:
             self.color = C.SCR_COLOR_NEUTRAL
         else:
@@ -289,15 +339,12 @@ class Daily(Task):
     def SetEvery(self, days):
         if self.frequency != "daily":
             self.frequency = "daily"
-            self.data['frequency'] = self.frequency
             self.repeat = C.DEFAULT_REPEAT
-            self.data['repeat'] = self.repeat
 
         self.everyX = days
-        self.data['everyX'] = days
 
         # Is it due today?
-        self.isDue     = H.isDueDaily(self.data)
+        self.isDue     = H.isDueDaily(self.frequency, self.repeat, self.everyX, self.startDate)
         if not self.isDue:
             self.color = C.SCR_COLOR_NEUTRAL
         else:
@@ -307,13 +354,15 @@ class Daily(Task):
 class TODO(Task):
     """ Class for holding a habit """
 
+    __slots__ = ['completed', 'checklist', 'dueDate', 'date', 'checklistMenu']
+
     def __init__(self, data):
         self.task_type = "todo"
         super(TODO, self).__init__(data)
 
         # Special Attributes
         self.completed = data['completed']
-        self.checklist = data['checklist']
+        self.checklist = CompactChecklist(data['checklist'])
 
         if data.has_key('date') and data['date'] != "" and data['date'] != None: # Due Date Stuff
             self.dueDate = H.DateTime(str(data['date'])).DueDateFormat()
@@ -322,8 +371,14 @@ class TODO(Task):
             self.dueDate = ""
             self.date    = ""
 
-        # Checklist Menu. None if it is empty
-        self.checklistMenu = ChecklistMenu(self.checklist)
+        # Checklist Menu, built when it is first shown
+        self.checklistMenu = None
+
+    def ToJSON(self):
+        data = super(TODO, self).ToJSON()
+        data.update({'completed': self.completed, 'checklist': self.checklist,
+                     'date': self.date})
+        return data
 
     def ChecklistTuple(self):  # Return (done/total)
         done = len([i for i in self.checklist if i['completed']])
@@ -331,14 +386,11 @@ class TODO(Task):
         return [done, total]
 
     def ChangeDueDate(self, date):
-        self.data['date'] = date
-        self.dueDate = H.DateTime(str(self.data['date'])).DueDateFormat()
-        self.date = str(self.data['date'])
+        self.dueDate = H.DateTime(str(date)).DueDateFormat()
+        self.date = str(date)
 
     def RemoveDueDate(self):
-        if self.data.has_key('date'):
-            self.data['date'] = ""
-        else:
+        if self.date == "":
             logger.warn('Trying to delete due date from task without one!')
 
         self.dueDate = ""
@@ -363,7 +415,7 @@ class TODO(Task):
 
     def ShowChecklist(self, menuItem):
         if self.checklistMenu == None:
-            return
+            self.checklistMenu = ChecklistMenu(self.checklist)
 
         G.screen.ClearTextArea()
         self.checklistMenu.Init()
@@ -376,4 +428,3 @@ class TODO(Task):
 
     def ChangeChecklist(self, checklist):
         self.checklist = checklist
-        self.data['checklist'] = checklist
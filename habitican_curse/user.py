@@ -33,6 +33,10 @@ def SignFormat(num):
 
     return '{0:+d}'.format(num)
 
+# Paths of the user document read by User and H.GetUserStats, requested with
+# RequestManager.FetchUserData instead of the whole document
+USER_FIELDS = ['_v', 'stats', 'items.gear.equipped']
+
 
 class User(object):
     """ Class to store user data """
@@ -55,6 +59,8 @@ class User(object):
         # Stats, gear etc.
         # Strength, Intelligence, Perception, Constitution
         self.attrStats   = {} # Will be updated when habitica content is fetched
+        self.shownDiff   = None # Last changes shown under the stats bar
+        self.party       = None # CT.Party, kept between views
         self.equipGear   = self.data['items']['gear']['equipped']
 
         self.cursorPositions = []
@@ -76,7 +82,8 @@ class User(object):
 
         # Stats, gear etc.
         # Strength, Intelligence, Perception, Constitution
-        self.attrStats   = H.GetUserStats(data)
+        if G.content is not None:
+            self.attrStats = H.GetUserStats(data)
         self.equipGear   = self.data['items']['gear']['equipped']
 
     def PrintData(self):
@@ -127,7 +134,10 @@ class User(object):
         cursor += len(string) + 3 - len(C.SYMBOL_GOLD)
 
         # Last Update
-        string = "Last Update: " + G.LastUpdate.strftime("%H:%M:%S %d/%m")
+        if G.stale:
+            string = "Cached: " + G.LastUpdate.strftime("%H:%M:%S %d/%m") + " (updating)"
+        else:
+            string = "Last Update: " + G.LastUpdate.strftime("%H:%M:%S %d/%m")
         G.screen.Display(string, C.SCR_X-2, cursor,
                 color=C.SCR_COLOR_MAGENTA_GRAY_BGRD, bold=True)
 
@@ -148,22 +158,57 @@ class User(object):
         G.screen.Display(string, C.SCR_X-2, C.SCR_Y-(3 + len(string)),
                 color=C.SCR_COLOR_MAGENTA_GRAY_BGRD, bold=True)
 
+    # Stats as used by the scoring model (see scoring.Score)
+    def StatsDict(self):
+        return {'hp': self.stats['hp'], 'mp': self.stats['mp'], 'gp': self.stats['gp'],
+                'exp': self.stats['exp'], 'lvl': self.stats['lvl'],
+                'maxMP': self.stats['maxMP'], 'maxHealth': self.stats['maxHealth']}
+
+    def Diff(self, newDict):
+        return {'hp': Round(newDict['hp']) - self.hp, 'mp': int(newDict['mp']) - self.mp,
+                'gp': int(newDict['gp']) - self.gp, 'exp': int(newDict['exp']) - self.exp,
+                'lvl': newDict['lvl'] - self.lvl}
+
+    def SetStats(self, newDict):
+        self.hp = Round(newDict['hp']); self.stats['hp'] = newDict['hp']
+        self.mp = int(newDict['mp']); self.stats['mp'] = newDict['mp']
+        self.gp = int(newDict['gp']); self.stats['gp'] = newDict['gp']
+        self.exp = int(newDict['exp']); self.stats['exp'] = newDict['exp']
+        self.lvl = newDict['lvl']; self.stats['lvl'] = newDict['lvl']
+        if newDict.has_key('toNextLevel'):
+            self.toNextLevel = Round(newDict['toNextLevel'])
+            self.stats['toNextLevel'] = newDict['toNextLevel']
+
     def PrintDiff(self, newDict):
-        diffDict = {}
+        diffDict = self.Diff(newDict)
+        self.SetStats(newDict)
+        self.DisplayDiff(diffDict)
 
-        diffDict['hp'] = Round(newDict['hp']) - self.hp; self.hp = Round(newDict['hp']); self.stats['hp'] = newDict['hp']
-        diffDict['mp'] = int(newDict['mp']) - self.mp; self.mp = int(newDict['mp']); self.stats['mp'] = newDict['mp']
-        diffDict['gp'] = int(newDict['gp']) - self.gp; self.gp = int(newDict['gp']); self.stats['gp'] = newDict['gp']
-        diffDict['exp'] = int(newDict['exp']) - self.exp; self.exp = int(newDict['exp']); self.stats['exp'] = newDict['exp']
-        diffDict['lvl'] = newDict['lvl'] - self.lvl; self.lvl = newDict['lvl']; self.stats['lvl'] = newDict['lvl']
+    # Show what the marked tasks are predicted to do to the stats, without
+    # changing them
+    def PrintPrediction(self, newDict):
+        G.screen.Display(" "*(C.SCR_Y-1), C.SCR_X-1, 0)
+        self.DisplayDiff(self.Diff(newDict), prefix="~")
 
+    def DisplayDiff(self, diffDict, prefix=""):
         for i in diffDict:
             diffDict[i] = SignFormat(diffDict[i])
+            if diffDict[i] != "":
+                diffDict[i] = prefix + diffDict[i]
 
         # Difficult to maintain the correct increase in experience when level changes
         if diffDict['lvl'] != "":
             diffDict['exp'] = ""
 
+        self.shownDiff = diffDict
+        self.RedisplayDiff()
+
+    # Draw the last shown changes again (after the screen was erased)
+    def RedisplayDiff(self):
+        diffDict = self.shownDiff
+        if diffDict is None:
+            return
+
         # Level
         G.screen.Display(diffDict['lvl'],C.SCR_X-1, self.cursorPositions[0]+2,
                 color=C.SCR_COLOR_WHITE, bold=True)
@@ -186,9 +231,14 @@ class User(object):
 
     def GetPartyData(self):
 
-        DEBUG.Display("Please Wait...")
-        resp = G.reqManager.FetchParty()
-        DEBUG.Display(" ")
-
-        partyObj = CT.Party(resp)
-        partyObj.Display()
+        # Reopening the party only fetches the new chat messages, unless its
+        # quest details are getting old
+        if self.party is None or self.party.Age() > CT.PARTY_MAX_AGE:
+            resp = G.intf.Await(G.reqManager.FetchPartyAsync())
+            if resp is None:
+                return
+            self.party = CT.Party(resp)
+        else:
+            self.party.RequestChat()
+
+        self.party.Display()
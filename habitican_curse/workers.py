@@ -0,0 +1,151 @@
+""" Module "Workers" : Background workers for network operations
+
+    A minimal future and a bounded pool of worker threads, used to run
+    requests to the Habitica server concurrently, and a dispatcher through
+    which the workers hand results back to the UI thread.
+"""
+# Standard Library Imports
+import threading
+import Queue
+
+#Set up logging
+import logging
+logger = logging.getLogger(__name__)
+logger.debug("Debug logging started for %s..." % __name__)
+
+
+class Future(object):
+    """ Placeholder for the result of an operation running in the background """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.result = None
+        self.error = None
+        self.callbacks = []
+
+    def SetResult(self, result):
+        self.result = result
+        self.Finish()
+
+    def SetError(self, error):
+        self.error = error
+        self.Finish()
+
+    def Finish(self):
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+    def Done(self):
+        return self.event.is_set()
+
+    def Failed(self):
+        return self.Done() and self.error is not None
+
+    def Wait(self, timeout=None):
+        # Returns True if the operation finished within the timeout
+        self.event.wait(timeout)
+        return self.Done()
+
+    def Result(self, timeout=None):
+        if not self.Wait(timeout):
+            raise RuntimeError("Operation still in progress")
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+    def AddDoneCallback(self, callback):
+        # Callbacks run on the thread that finishes the operation, or right
+        # away if it has already finished
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+
+        callback(self)
+
+
+class WorkerPool(object):
+    """ A fixed number of daemon threads consuming jobs from a shared queue """
+
+    def __init__(self, num_workers):
+        self.jobs = Queue.Queue()
+        self.threads = []
+
+        for i in xrange(max(num_workers, 1)):
+            thread = threading.Thread(target=self.Work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def Submit(self, function, *args, **kwargs):
+        future = Future()
+        self.jobs.put((future, function, args, kwargs))
+        return future
+
+    def Work(self):
+        while(1):
+            future, function, args, kwargs = self.jobs.get()
+            try:
+                future.SetResult(function(*args, **kwargs))
+            except Exception as e:
+                logger.debug("Background job failed: %s" % str(e))
+                future.SetError(e)
+
+
+class Dispatcher(object):
+    """ Callbacks posted from any thread, run in order on the thread which
+    calls RunPending (the UI thread, see Interface.Input) """
+
+    def __init__(self):
+        self.pending = Queue.Queue()
+
+    def Post(self, function, *args, **kwargs):
+        self.pending.put((function, args, kwargs))
+
+    def OnDone(self, future, callback):
+        # callback(future) on the UI thread once the future has finished
+        future.AddDoneCallback(lambda f: self.Post(callback, f))
+
+    def RunPending(self):
+        # Returns the number of callbacks run
+        ran = 0
+        while(1):
+            try:
+                function, args, kwargs = self.pending.get_nowait()
+            except Queue.Empty:
+                return ran
+
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                logger.warn("Posted callback failed: %s" % str(e))
+            ran += 1
+
+
+def Spawn(function, *args, **kwargs):
+    # Run a single job on its own daemon thread
+    future = Future()
+
+    def Run():
+        try:
+            future.SetResult(function(*args, **kwargs))
+        except Exception as e:
+            logger.debug("Background job failed: %s" % str(e))
+            future.SetError(e)
+
+    thread = threading.Thread(target=Run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def WaitAll(futures):
+    for future in futures:
+        future.Wait()